@@ -0,0 +1,332 @@
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest import mock
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString, box
+
+import functions_geodados
+from functions_coordenadas import EXTENSAO_SALVADOR
+from functions_geodados import (bairro_correcao, coordenada_numero_porta, coordenada_numero_porta_lote,
+                                coordenadas_por_endereco, endereco_por_cep, setor_bairro_correcao,
+                                setor_fiscal_correto)
+from functions_importacao import verificar_orcamento_importacao
+from functions_log import configurar_log, metricas
+from functions_verticais import COLUNAS_VERTICAIS, criar_df_com_moda, intervalo_ativas_verticais_lote
+
+
+# Benchmark das funções de validação com camadas e cadastros sintéticos (sem shapefiles da prefeitura nem banco)
+# uso: python benchmark_geodados.py --escalas 1000,100000,1000000 --json resultados.json
+# CEP, geocodificador e banco são simulados; o log fica no nível WARNING (use --log para mudar)
+
+# quantidade de logradouros, grade de setores fiscais (colunas x linhas) e grade de bairros das camadas sintéticas
+LOGRADOUROS = 3000
+GRADE_SETORES = (23, 17)
+GRADE_BAIRROS = (14, 12)
+# escalas padrão (linhas do cadastro) e tempo máximo estimado por escala antes de pular as seguintes
+ESCALAS = (1000, 100000, 1000000)
+TEMPO_MAXIMO = 900
+
+
+# função auxiliar das camadas sintéticas
+# polígonos em grade cobrindo a extensão, com nome prefixo + coluna + linha
+def _grade(colunas, linhas, prefixo, nome_coluna):
+    xmin, ymin, xmax, ymax = EXTENSAO_SALVADOR
+    largura, altura = (xmax - xmin) / colunas, (ymax - ymin) / linhas
+    poligonos = [
+        {nome_coluna: f"{prefixo}{i:02d}{j:02d}",
+         'geometry': box(xmin + i * largura, ymin + j * altura, xmin + (i + 1) * largura, ymin + (j + 1) * altura)}
+        for i in range(colunas) for j in range(linhas)]
+    return gpd.GeoDataFrame(poligonos, crs='EPSG:31984')
+
+
+# Nome do polígono da grade que contém cada ponto (mesma regra da _grade)
+def nome_na_grade(x, y, grade, prefixo):
+    xmin, ymin, xmax, ymax = EXTENSAO_SALVADOR
+    colunas, linhas = grade
+    i = np.clip(((np.asarray(x) - xmin) / ((xmax - xmin) / colunas)).astype(int), 0, colunas - 1)
+    j = np.clip(((np.asarray(y) - ymin) / ((ymax - ymin) / linhas)).astype(int), 0, linhas - 1)
+    return pd.Series(i).map('{:02d}'.format).radd(prefixo) + pd.Series(j).map('{:02d}'.format)
+
+
+# Eixos de logradouro sintéticos: ruas horizontais e verticais de 1 a 3 km em 3 a 6 trechos
+# parte dos trechos vem invertida e fora de ordem, como nos eixos da prefeitura
+def eixos_sinteticos(n=LOGRADOUROS, seed=1):
+    rnd = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = EXTENSAO_SALVADOR
+    trechos = []
+    for i in range(n):
+        codlog = 10000 + i
+        comprimento = rnd.uniform(1000, 3000)
+        partes = int(rnd.integers(3, 7))
+        x0 = rnd.uniform(xmin, xmax - comprimento)
+        y0 = rnd.uniform(ymin, ymax - comprimento)
+        distancias = np.linspace(0, comprimento, partes + 1)
+        if i % 2 == 0:
+            pontos = [(x0 + d, y0) for d in distancias]
+        else:
+            pontos = [(x0, y0 + d) for d in distancias]
+        linhas = [pontos[k:k + 2] for k in range(partes)]
+        if i % 3 == 0:
+            linhas = [linhas[1], linhas[0][::-1]] + linhas[2:]
+        trechos.extend({'codlog': codlog, 'geometry': LineString(linha)} for linha in linhas)
+    return gpd.GeoDataFrame(trechos, crs='EPSG:31984')
+
+
+# Grava as camadas sintéticas no diretorio e retorna os caminhos
+# eixos_bairro.shp tem o codlog na coluna 'Código _1' em utf-8, como a camada lida pela bairro_correcao
+def gerar_camadas(diretorio, logradouros=LOGRADOUROS, seed=1):
+    os.makedirs(diretorio, exist_ok=True)
+    camadas = {
+        'eixos': os.path.join(diretorio, 'eixos.shp'),
+        'eixos_bairro': os.path.join(diretorio, 'eixos_bairro.shp'),
+        'setores': os.path.join(diretorio, 'setores.shp'),
+        'bairros': os.path.join(diretorio, 'bairros.shp'),
+    }
+    eixos = eixos_sinteticos(logradouros, seed)
+    eixos.to_file(camadas['eixos'])
+    eixos.rename(columns={'codlog': 'Código _1'}).to_file(camadas['eixos_bairro'], encoding='utf-8')
+    _grade(*GRADE_SETORES, 'S', 'Name').to_file(camadas['setores'])
+    _grade(*GRADE_BAIRROS, 'B', 'Bairro').to_file(camadas['bairros'])
+    camadas['comprimentos'] = eixos.assign(comprimento=eixos.length).groupby('codlog')['comprimento'].sum()
+    return camadas
+
+
+# Cadastro sintético com as colunas usadas pelas funções de validação
+# 2% dos codlogs não existem nos eixos, 15% dos imóveis não têm nº de porta e 5% passam do fim do logradouro
+# 40% têm coordenada sedur (x como texto com vírgula); setor e bairro estão certos em 90% dos imóveis com coordenada
+def cadastro_sintetico(n, comprimentos, seed=2):
+    rnd = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = EXTENSAO_SALVADOR
+    codlogs = rnd.choice(comprimentos.index.to_numpy(), n)
+    codlogs[rnd.random(n) < 0.02] += 1000000
+    fracao = rnd.uniform(0, 1.0, n)
+    fracao[rnd.random(n) < 0.05] = 1.1
+    numeros = (fracao * comprimentos.reindex(codlogs).fillna(1000).to_numpy()).round(0) * 100000
+    numeros[rnd.random(n) < 0.15] = 0
+    x = rnd.uniform(xmin, xmax, n).round(2)
+    y = rnd.uniform(ymin, ymax, n).round(2)
+    tem_coordenada = rnd.random(n) < 0.4
+    certo = tem_coordenada & (rnd.random(n) < 0.9)
+    setor_aleatorio = nome_na_grade(rnd.uniform(xmin, xmax, n), rnd.uniform(ymin, ymax, n), GRADE_SETORES, 'S')
+    bairro_aleatorio = nome_na_grade(rnd.uniform(xmin, xmax, n), rnd.uniform(ymin, ymax, n), GRADE_BAIRROS, 'B')
+    return pd.DataFrame({
+        'cod._logradouro_localização': pd.Series(codlogs).astype(str) + '-' + pd.Series(codlogs % 7).astype(str),
+        'nº_métrico_localização': numeros,
+        'coordenada_x': x,
+        'coordenada_y': y,
+        'codlog': codlogs,
+        'numero': numeros,
+        'x': np.where(tem_coordenada, pd.Series(x).astype(str).str.replace('.', ',', regex=False), None),
+        'y': np.where(tem_coordenada, y, np.nan),
+        'setor': np.where(certo, nome_na_grade(x, y, GRADE_SETORES, 'S'), setor_aleatorio),
+        'bairro': np.where(certo, nome_na_grade(x, y, GRADE_BAIRROS, 'B'), bairro_aleatorio),
+        'cep': pd.Series(rnd.integers(40000, 40000 + max(n // 10, 1), n)).map('{:05d}000'.format),
+        'inscricao': pd.Series(rnd.integers(10000, 10000 + max(n // 8, 1), n) * 100 + rnd.integers(0, 100, n)).astype(str),
+    })
+
+
+# Conexão simulada do banco: responde à consulta da intervalo_ativas_verticais_lote
+# cada prefixo tem de 2 a 40 unidades ativas verticais com padrão construtivo sorteado
+class ConexaoSimulada:
+    def __init__(self, seed=3):
+        self.seed = seed
+
+    def cursor(self):
+        return CursorSimulado(self.seed)
+
+
+class CursorSimulado:
+    def __init__(self, seed):
+        self.rnd = np.random.default_rng(seed)
+        self.linhas = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        return False
+
+    def execute(self, query, parametros=None):
+        prefixos = parametros[0]
+        quantidades = self.rnd.integers(2, 41, len(prefixos))
+        padroes = ['A', 'B', 'C', 'D', None]
+        self.linhas = [
+            (prefixo, f"{prefixo}{k:02d}", 'ATIVO', str(k), None, 10000, k, 'EDIFICIO', None, None,
+             padroes[int(self.rnd.integers(0, 5))])
+            for prefixo, quantidade in zip(prefixos, quantidades) for k in range(quantidade)]
+
+    def fetchall(self):
+        return self.linhas
+
+
+# CEP, geocodificador e banco simulados: nenhuma chamada do benchmark sai para a rede ou para o PostgreSQL
+@contextlib.contextmanager
+def backends_simulados():
+    def cep(numero):
+        return {'street': f"Rua {numero}", 'district': f"Bairro {int(numero) % 97}", 'city': 'Salvador', 'uf': 'BA'}
+
+    geocodificador = SimpleNamespace(
+        geocode=lambda endereco: SimpleNamespace(latitude=-12.97, longitude=-38.50 - len(endereco) / 1e4))
+    with mock.patch.object(functions_geodados.brazilcep, 'get_address_from_cep', cep), \
+            mock.patch('functions_consultas.geocodificador', lambda *args, **kwargs: geocodificador), \
+            mock.patch('functions_consultas.limitador_compartilhado', lambda *args: (lambda: None)), \
+            mock.patch('functions_verticais.psycopg2.connect', side_effect=RuntimeError('banco desativado no benchmark')):
+        yield
+
+
+# Casos do benchmark: cada um recebe (cadastro, camadas) e devolve a função medida (sem argumentos)
+# a função é chamada uma vez com zero linhas antes da medição (camadas, índices e tabelas de sobreposição já prontos)
+def _caso_coordenada_numero_porta(df, camadas):
+    return lambda: coordenada_numero_porta(camadas['eixos'], df)
+
+
+def _caso_coordenada_numero_porta_lote(df, camadas):
+    return lambda: coordenada_numero_porta_lote(camadas['eixos'], df)
+
+
+def _caso_setor_fiscal_correto(df, camadas):
+    return lambda: setor_fiscal_correto(
+        camadas['eixos'], camadas['setores'], 'codlog', 'numero', 'x', 'y', 'setor', df)
+
+
+def _caso_bairro_correcao(df, camadas):
+    return lambda: bairro_correcao(
+        camadas['eixos_bairro'], camadas['bairros'], 'codlog', 'numero', 'x', 'y', 'bairro', df)
+
+
+def _caso_setor_bairro_correcao(df, camadas):
+    return lambda: setor_bairro_correcao(
+        camadas['eixos'], camadas['setores'], camadas['bairros'], 'codlog', 'numero', 'x', 'y', 'setor', 'bairro', df)
+
+
+def _caso_criar_df_com_moda(df, camadas):
+    def executar():
+        inscricoes = df['inscricao'].tolist()
+        intervalos = intervalo_ativas_verticais_lote(ConexaoSimulada(), 1, 'IPTU', inscricoes)
+        intervalo = pd.concat(intervalos.values(), ignore_index=True) if intervalos else pd.DataFrame(columns=COLUNAS_VERTICAIS)
+        return criar_df_com_moda(intervalo, inscricoes)
+    return executar
+
+
+def _caso_consultas(df, camadas):
+    def executar():
+        for cep in df['cep']:
+            endereco = endereco_por_cep(cep)
+            coordenadas_por_endereco(f"{endereco['street']}, {endereco['district']}, Salvador, BA, Brasil", 'benchmark')
+    return executar
+
+
+CASOS = {
+    'coordenada_numero_porta': _caso_coordenada_numero_porta,
+    'coordenada_numero_porta_lote': _caso_coordenada_numero_porta_lote,
+    'setor_fiscal_correto': _caso_setor_fiscal_correto,
+    'bairro_correcao': _caso_bairro_correcao,
+    'setor_bairro_correcao': _caso_setor_bairro_correcao,
+    'criar_df_com_moda': _caso_criar_df_com_moda,
+    'consultas': _caso_consultas,
+}
+
+
+# função auxiliar da medir
+# executa a função com a saída impressa descartada e retorna (segundos, pico de memória em bytes ou None)
+def _executar(funcao, memoria):
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        if memoria:
+            tracemalloc.start()
+        inicio = time.perf_counter()
+        try:
+            funcao()
+        finally:
+            segundos = time.perf_counter() - inicio
+            pico = tracemalloc.get_traced_memory()[1] if memoria else None
+            if memoria:
+                tracemalloc.stop()
+    return segundos, pico
+
+
+# Mede um caso numa escala: tempo (sem tracemalloc, que deixa a execução mais lenta) e, numa segunda execução, o pico de memória
+# etapas e contadores vêm das métricas da execução medida (functions_log)
+def medir(nome, df, camadas, memoria=True):
+    preparar = CASOS[nome]
+    _executar(preparar(df.iloc[:0], camadas), False)
+    metricas.reiniciar()
+    segundos, _ = _executar(preparar(df, camadas), False)
+    resumo = metricas.resumo()
+    pico = _executar(preparar(df, camadas), True)[1] if memoria else None
+    return {
+        'funcao': nome,
+        'linhas': len(df),
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(len(df) / segundos, 1) if segundos else None,
+        'pico_memoria_mb': round(pico / 2 ** 20, 1) if pico is not None else None,
+        'etapas': resumo['etapas'],
+        'contadores': resumo['contadores'],
+    }
+
+
+# Executa os casos nas escalas informadas
+# uma escala cuja duração estimada (pela escala anterior, proporcional ao número de linhas) passa de tempo_maximo é pulada
+def executar_benchmark(diretorio, casos=tuple(CASOS), escalas=ESCALAS, memoria=True, tempo_maximo=TEMPO_MAXIMO,
+                       logradouros=LOGRADOUROS):
+    os.environ['GEODADOS_CACHE'] = os.path.join(diretorio, 'cache')
+    os.environ['GEODADOS_CACHE_CONSULTAS'] = os.path.join(diretorio, 'cache', 'consultas_benchmark.sqlite')
+    inicio = time.perf_counter()
+    camadas = gerar_camadas(os.path.join(diretorio, 'camadas'), logradouros)
+    print(f"Camadas sintéticas geradas em {time.perf_counter() - inicio:.1f} s ({logradouros} logradouros).")
+
+    resultados = []
+    with backends_simulados():
+        for nome in casos:
+            anterior = None
+            for escala in sorted(escalas):
+                if anterior and anterior['segundos'] * escala / anterior['linhas'] > tempo_maximo:
+                    print(f"{nome}: escala {escala} pulada (estimativa acima de {tempo_maximo} s).")
+                    resultados.append({'funcao': nome, 'linhas': escala, 'pulada': True})
+                    continue
+                df = cadastro_sintetico(escala, camadas['comprimentos'])
+                anterior = medir(nome, df, camadas, memoria)
+                resultados.append(anterior)
+                print(f"{nome:<30} {escala:>9} linhas  {anterior['segundos']:>10.2f} s  "
+                      f"{anterior['linhas_por_segundo'] or 0:>12.0f} linhas/s  "
+                      f"{anterior['pico_memoria_mb'] if memoria else '-':>8} MB")
+    return resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark das funções de validação com dados sintéticos.')
+    parser.add_argument('--escalas', default=','.join(map(str, ESCALAS)), help='linhas do cadastro, separadas por vírgula')
+    parser.add_argument('--casos', default=','.join(CASOS), help=f"casos, separados por vírgula ({', '.join(CASOS)})")
+    parser.add_argument('--diretorio', default=None, help='diretório das camadas e do cache (padrão: temporário)')
+    parser.add_argument('--tempo-maximo', type=float, default=TEMPO_MAXIMO, help='segundos estimados por escala')
+    parser.add_argument('--logradouros', type=int, default=LOGRADOUROS)
+    parser.add_argument('--sem-memoria', action='store_true', help='não mede o pico de memória (tracemalloc)')
+    parser.add_argument('--json', default=None, help='arquivo para gravar os resultados')
+    parser.add_argument('--log', default='WARNING', help='nível do log das funções medidas')
+    parser.add_argument('--importacao', action='store_true', help='mede também o tempo de importação dos módulos')
+    argumentos = parser.parse_args()
+    configurar_log(argumentos.log)
+
+    importacao = []
+    if argumentos.importacao:
+        importacao = verificar_orcamento_importacao()
+        for medicao in importacao:
+            print(f"importação {medicao['modulo']:<24} {medicao['segundos']:>7.3f} s  (limite {medicao['limite']:.3f} s)  "
+                  f"{'ok' if medicao['dentro_do_orcamento'] else 'ACIMA DO ORÇAMENTO'}")
+
+    resultados = executar_benchmark(
+        argumentos.diretorio or tempfile.mkdtemp(prefix='benchmark_geodados_'),
+        [caso for caso in argumentos.casos.split(',') if caso],
+        [int(escala) for escala in argumentos.escalas.split(',') if escala],
+        not argumentos.sem_memoria, argumentos.tempo_maximo, argumentos.logradouros)
+    if argumentos.json:
+        with open(argumentos.json, 'w', encoding='utf-8') as arquivo:
+            json.dump({'funcoes': resultados, 'importacao': importacao}, arquivo, indent=2, ensure_ascii=False)
@@ -0,0 +1,201 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from functions_importacao import modulo_tardio
+from functions_log import etapa
+
+
+gpd = modulo_tardio('geopandas')
+
+
+# diretório padrão dos arquivos de cache (pode ser trocado pela variável de ambiente GEODADOS_CACHE)
+def diretorio_cache():
+    diretorio = os.environ.get('GEODADOS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'geodados'))
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+
+# Versão de uma camada em disco
+# hash do caminho, tamanho e data de modificação do arquivo e dos arquivos auxiliares (.dbf, .shx, .prj, ...)
+def versao_camada(caminho):
+    caminho = os.path.abspath(caminho)
+    base, _ = os.path.splitext(caminho)
+    pasta = os.path.dirname(caminho)
+    nome_base = os.path.basename(base)
+    arquivos = sorted(
+        os.path.join(pasta, nome) for nome in os.listdir(pasta)
+        if os.path.splitext(nome)[0] == nome_base)
+    assinatura = hashlib.sha1()
+    for arquivo in arquivos or [caminho]:
+        estado = os.stat(arquivo)
+        assinatura.update(f"{arquivo}|{estado.st_size}|{estado.st_mtime_ns}\n".encode('utf-8'))
+    return assinatura.hexdigest()
+
+
+# camadas já abertas neste processo, por chave de cache
+_camadas_carregadas = {}
+
+
+# Camada vetorial com cache em GeoParquet
+# na primeira leitura o shapefile é reprojetado para o crs, tem as colunas renomeadas e é salvo como snapshot em parquet
+# a chave do snapshot é o caminho, a versão do arquivo (tamanho e data de modificação) e os parâmetros de leitura
+# as leituras seguintes abrem o snapshot com memory map, sem decodificar .dbf/.shp de novo
+def carregar_camada(caminho, crs='EPSG:31984', encoding=None, renomear=None):
+    origem = hashlib.sha1('|'.join([
+        os.path.abspath(caminho), str(crs), str(encoding),
+        str(sorted((renomear or {}).items()))]).encode('utf-8')).hexdigest()[:16]
+    versao = versao_camada(caminho)[:16]
+    chave = f"camada_{origem}_{versao}"
+
+    if chave in _camadas_carregadas:
+        return _camadas_carregadas[chave].copy(deep=False)
+
+    caminho_snapshot = os.path.join(diretorio_cache(), f"{chave}.parquet")
+    if os.path.exists(caminho_snapshot):
+        camada = gpd.read_parquet(caminho_snapshot, memory_map=True)
+    else:
+        if encoding:
+            camada = gpd.read_file(caminho, encoding=encoding)
+        else:
+            camada = gpd.read_file(caminho)
+        if camada.crs is None:
+            camada = camada.set_crs(crs)
+        elif crs is not None:
+            with etapa('reprojecao'):
+                camada = camada.to_crs(crs)
+        if renomear:
+            camada = camada.rename(columns=renomear)
+
+        # snapshots de versões anteriores da mesma camada são descartados
+        for antigo in glob.glob(os.path.join(diretorio_cache(), f"camada_{origem}_*.parquet")):
+            os.remove(antigo)
+        camada.to_parquet(caminho_snapshot + '.tmp', index=False)
+        os.replace(caminho_snapshot + '.tmp', caminho_snapshot)
+
+    for antiga in [c for c in _camadas_carregadas if c.startswith(f"camada_{origem}_")]:
+        del _camadas_carregadas[antiga]
+    _camadas_carregadas[chave] = camada
+    return camada.copy(deep=False)
+
+
+# validade padrão (em segundos) das respostas guardadas no cache de consultas
+TTL_CONSULTA = 30 * 24 * 3600
+# validade das respostas de "não encontrado" (cache negativo)
+TTL_NAO_ENCONTRADO = 7 * 24 * 3600
+# quantidade máxima de respostas no cache; acima disso as menos usadas recentemente são descartadas
+MAXIMO_CONSULTAS = 200000
+
+_conexoes_consultas = {}
+_trava_consultas = threading.Lock()
+_gravacoes_consultas = 0
+
+
+# modo offline: consultas respondidas apenas pelo cache (variável de ambiente GEODADOS_OFFLINE=1)
+def modo_offline():
+    return os.environ.get('GEODADOS_OFFLINE', '').lower() in ('1', 'true', 'sim')
+
+
+# função auxiliar do cache de consultas
+# conexão sqlite reaproveitada por caminho (cache em GEODADOS_CACHE_CONSULTAS ou consultas.sqlite no diretório de cache)
+def _banco_consultas(caminho=None):
+    caminho = caminho or os.environ.get('GEODADOS_CACHE_CONSULTAS') or os.path.join(diretorio_cache(), 'consultas.sqlite')
+    if caminho not in _conexoes_consultas:
+        conn = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        conn.execute("""
+            create table if not exists consultas (
+                servico text not null,
+                chave text not null,
+                valor text,
+                expira_em real not null,
+                ultimo_acesso real not null,
+                primary key (servico, chave)
+            )
+        """)
+        conn.execute("create index if not exists consultas_ultimo_acesso on consultas (ultimo_acesso)")
+        conn.commit()
+        _conexoes_consultas[caminho] = conn
+    return _conexoes_consultas[caminho]
+
+
+# Resposta guardada no cache de consultas (cep, viacep, ...)
+# retorna (True, valor) quando há resposta válida, com valor None para "não encontrado", ou (False, None) quando não há
+# aceitar_expirado devolve respostas vencidas (usado no modo offline)
+def cache_consulta_obter(servico, chave, caminho=None, aceitar_expirado=False):
+    agora = time.time()
+    with _trava_consultas:
+        conn = _banco_consultas(caminho)
+        linha = conn.execute(
+            "select valor, expira_em from consultas where servico = ? and chave = ?", (servico, chave)).fetchone()
+        if linha is None or (linha[1] < agora and not aceitar_expirado):
+            return False, None
+        conn.execute(
+            "update consultas set ultimo_acesso = ? where servico = ? and chave = ?", (agora, servico, chave))
+        conn.commit()
+    return True, (json.loads(linha[0]) if linha[0] is not None else None)
+
+
+# Guarda uma resposta no cache de consultas
+# valor None registra "não encontrado" com validade TTL_NAO_ENCONTRADO
+def cache_consulta_gravar(servico, chave, valor, ttl=None, caminho=None, maximo=MAXIMO_CONSULTAS):
+    global _gravacoes_consultas
+    if ttl is None:
+        ttl = TTL_CONSULTA if valor is not None else TTL_NAO_ENCONTRADO
+    agora = time.time()
+    with _trava_consultas:
+        conn = _banco_consultas(caminho)
+        conn.execute(
+            "insert or replace into consultas (servico, chave, valor, expira_em, ultimo_acesso) values (?, ?, ?, ?, ?)",
+            (servico, chave, json.dumps(valor, ensure_ascii=False) if valor is not None else None, agora + ttl, agora))
+
+        # descarte das menos usadas recentemente (verificado a cada 100 gravações)
+        _gravacoes_consultas += 1
+        if _gravacoes_consultas % 100 == 1:
+            excesso = conn.execute("select count(*) from consultas").fetchone()[0] - maximo
+            if excesso > 0:
+                conn.execute(
+                    "delete from consultas where rowid in (select rowid from consultas order by ultimo_acesso limit ?)",
+                    (excesso,))
+        conn.commit()
+
+
+# Exporta o cache de consultas para um arquivo JSON lines (uma resposta por linha)
+def cache_consulta_exportar(arquivo, caminho=None):
+    with _trava_consultas:
+        linhas = _banco_consultas(caminho).execute(
+            "select servico, chave, valor, expira_em from consultas").fetchall()
+    with open(arquivo, 'w', encoding='utf-8') as saida:
+        for servico, chave, valor, expira_em in linhas:
+            saida.write(json.dumps({
+                'servico': servico, 'chave': chave,
+                'valor': json.loads(valor) if valor is not None else None,
+                'expira_em': expira_em}, ensure_ascii=False) + '\n')
+    return len(linhas)
+
+
+# Aquece o cache de consultas a partir de um arquivo JSON lines gerado pela cache_consulta_exportar
+# com ttl informado as respostas importadas recebem nova validade; sem ttl mantêm a validade do arquivo
+def cache_consulta_importar(arquivo, caminho=None, ttl=None):
+    agora = time.time()
+    registros = []
+    with open(arquivo, encoding='utf-8') as entrada:
+        for linha in entrada:
+            if not linha.strip():
+                continue
+            item = json.loads(linha)
+            valor = item.get('valor')
+            expira_em = agora + ttl if ttl is not None else item.get('expira_em', agora + TTL_CONSULTA)
+            registros.append((
+                item['servico'], item['chave'],
+                json.dumps(valor, ensure_ascii=False) if valor is not None else None, expira_em, agora))
+    with _trava_consultas:
+        conn = _banco_consultas(caminho)
+        conn.executemany(
+            "insert or replace into consultas (servico, chave, valor, expira_em, ultimo_acesso) values (?, ?, ?, ?, ?)",
+            registros)
+        conn.commit()
+    return len(registros)
@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from functions_cache import versao_camada
+from functions_coordenadas import EXTENSAO_SALVADOR
+from functions_geodados import bairro_correcao, setor_bairro_correcao, setor_fiscal_correto
+from functions_log import contar, etapa, obter_logger
+
+
+logger = obter_logger('checkpoint')
+
+
+# linhas da entrada processadas entre dois checkpoints
+TAMANHO_LOTE_CHECKPOINT = 10000
+# versão do formato dos checkpoints (e das regras das funções de correção); mudar invalida checkpoints antigos
+VERSAO_CHECKPOINT = 1
+# coluna auxiliar com a impressão digital de cada linha da entrada (acompanha a linha até o resultado)
+COLUNA_IMPRESSAO = '__impressao'
+
+
+# Impressão digital de cada linha: hash dos valores de todas as colunas (sem o índice)
+def impressoes_linhas(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+# Chave de uma execução: função, versões das camadas (parâmetros caminho_*) e demais parâmetros
+# com camadas ou parâmetros diferentes nenhum resultado anterior é reaproveitado
+def chave_execucao(funcao, parametros):
+    partes = [f"{funcao.__module__}.{funcao.__qualname__}", str(VERSAO_CHECKPOINT)]
+    for nome, valor in sorted(parametros.items()):
+        if nome.startswith('caminho') and valor:
+            partes.append(f"{nome}={versao_camada(valor)}")
+        else:
+            partes.append(f"{nome}={valor!r}")
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
+
+
+# função auxiliar da executar_com_checkpoint
+# manifesto do diretório de checkpoint (chave da execução e lotes gravados, na ordem)
+def _ler_manifesto(diretorio):
+    caminho = os.path.join(diretorio, 'manifesto.json')
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def _gravar_manifesto(diretorio, manifesto):
+    caminho = os.path.join(diretorio, 'manifesto.json')
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, indent=2)
+    os.replace(caminho + '.tmp', caminho)
+
+
+# função auxiliar da executar_com_checkpoint
+# grava um lote (impressões das linhas processadas + linhas de resultado) e só depois o registra no manifesto
+# os resultados vão em pickle porque podem misturar colunas de geometria (shapely) com colunas comuns
+def _gravar_lote(diretorio, manifesto, impressoes, resultado):
+    nome = f"lote_{len(manifesto['lotes']):06d}.pkl"
+    caminho = os.path.join(diretorio, nome)
+    pd.to_pickle({'impressoes': impressoes, 'resultado': resultado}, caminho + '.tmp')
+    os.replace(caminho + '.tmp', caminho)
+    manifesto['lotes'].append(nome)
+    _gravar_manifesto(diretorio, manifesto)
+
+
+# Executa uma função de correção em lotes, gravando um checkpoint a cada lote
+# funcao recebe o lote em df= e os demais parâmetros por nome; deve devolver um DataFrame com as linhas sinalizadas
+# numa nova execução (depois de uma falha ou na revalidação mensal) linhas com a mesma impressão digital, mesmas camadas
+# e mesmos parâmetros não são processadas de novo: o resultado vem do checkpoint
+# retorna o DataFrame de resultados na ordem da entrada, como a função devolveria para a entrada inteira
+def executar_com_checkpoint(funcao, df, diretorio, tamanho_lote=TAMANHO_LOTE_CHECKPOINT, **parametros):
+    os.makedirs(diretorio, exist_ok=True)
+    chave = chave_execucao(funcao, parametros)
+    manifesto = _ler_manifesto(diretorio)
+    if manifesto is None or manifesto['chave'] != chave:
+        # camadas, parâmetros ou função mudaram: checkpoints antigos não valem mais
+        for antigo in glob.glob(os.path.join(diretorio, 'lote_*.pkl')):
+            os.remove(antigo)
+        manifesto = {'chave': chave, 'funcao': f"{funcao.__module__}.{funcao.__qualname__}", 'lotes': []}
+        _gravar_manifesto(diretorio, manifesto)
+
+    entrada = df.reset_index(drop=True)
+    impressoes = impressoes_linhas(entrada)
+    entrada[COLUNA_IMPRESSAO] = impressoes
+
+    # resultados já gravados
+    processadas = set()
+    anteriores = []
+    for nome in manifesto['lotes']:
+        lote = pd.read_pickle(os.path.join(diretorio, nome))
+        processadas.update(lote['impressoes'].tolist())
+        anteriores.append(lote['resultado'])
+
+    pendentes = np.flatnonzero(~pd.Series(impressoes).isin(processadas).to_numpy())
+    logger.info("%d linhas reaproveitadas do checkpoint; %d linhas a processar.", len(entrada) - len(pendentes), len(pendentes))
+    contar('reaproveitadas_checkpoint', len(entrada) - len(pendentes))
+
+    # aquece camadas, índice de logradouros e polígonos por logradouro uma vez (guardados por versão das camadas),
+    # compartilhados por todos os lotes; o resultado vazio dá o formato quando não há linhas sinalizadas
+    vazio = funcao(df=entrada.iloc[:0], **parametros)
+    for inicio in range(0, len(pendentes), tamanho_lote):
+        posicoes = pendentes[inicio:inicio + tamanho_lote]
+        try:
+            resultado = funcao(df=entrada.iloc[posicoes].reset_index(drop=True), **parametros)
+        except Exception as e:
+            logger.exception("Erro no lote a partir da linha %d: %s. Os lotes anteriores ficam no checkpoint.", posicoes[0], e)
+            contar('erros')
+            raise
+        with etapa('checkpoint'):
+            _gravar_lote(diretorio, manifesto, impressoes[posicoes], resultado)
+        anteriores.append(resultado)
+
+    # resultados das linhas da entrada atual, na ordem da entrada (linhas repetidas repetem o resultado)
+    # os lotes entram pela posição da primeira linha na entrada atual, reproduzindo a ordem das colunas do caminho serial
+    posicao = pd.Series(np.arange(len(impressoes)), index=impressoes)
+    posicao = posicao[~posicao.index.duplicated()]
+    partes = [resultado[resultado[COLUNA_IMPRESSAO].isin(posicao.index)] for resultado in anteriores
+              if len(resultado) and COLUNA_IMPRESSAO in resultado.columns]
+    partes = sorted((parte for parte in partes if len(parte)), key=lambda parte: posicao[parte[COLUNA_IMPRESSAO]].min())
+    if partes:
+        resultados = pd.concat(partes, ignore_index=True).drop_duplicates(COLUNA_IMPRESSAO)
+    else:
+        resultados = vazio.iloc[:0]
+
+    # linhas que saíram da entrada ocupam o checkpoint sem uso: quando passam das atuais, os lotes viram um só
+    atuais = np.unique(impressoes)
+    if len(manifesto['lotes']) > 1 and len(processadas - set(atuais.tolist())) > len(atuais):
+        for nome in manifesto['lotes']:
+            os.remove(os.path.join(diretorio, nome))
+        manifesto['lotes'] = []
+        _gravar_lote(diretorio, manifesto, atuais, resultados)
+
+    if not len(resultados) or COLUNA_IMPRESSAO not in resultados.columns:
+        return vazio.drop(columns=COLUNA_IMPRESSAO, errors='ignore')
+    resultados = resultados.set_index(COLUNA_IMPRESSAO)
+    com_resultado = impressoes[pd.Series(impressoes).isin(resultados.index).to_numpy()]
+    return resultados.loc[com_resultado].reset_index(drop=True)
+
+
+# bairro_correcao com checkpoints em diretorio (ver executar_com_checkpoint)
+def bairro_correcao_incremental(caminho_arquivo_log, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_bairro, df, diretorio, comprimento_minimo=0.0, tamanho_lote=TAMANHO_LOTE_CHECKPOINT,
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_com_checkpoint(
+        bairro_correcao, df, diretorio, tamanho_lote,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_bairro=caminho_arquivo_bairro,
+        nome_coluna_log=nome_coluna_log, nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_bairro=nome_coluna_bairro, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
+
+
+# setor_fiscal_correto com checkpoints em diretorio (ver executar_com_checkpoint)
+def setor_fiscal_correto_incremental(caminho_arquivo_log, caminho_arquivo_setor, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, df, diretorio, comprimento_minimo=0.0, tamanho_lote=TAMANHO_LOTE_CHECKPOINT,
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_com_checkpoint(
+        setor_fiscal_correto, df, diretorio, tamanho_lote,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_setor=caminho_arquivo_setor,
+        nome_coluna_log=nome_coluna_log, nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_sfiscal=nome_coluna_sfiscal, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
+
+
+# setor_bairro_correcao com checkpoints em diretorio (ver executar_com_checkpoint)
+def setor_bairro_correcao_incremental(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, nome_coluna_bairro, df, diretorio, coluna_codlog_eixos='codlog', encoding_eixos=None, comprimento_minimo=0.0, tamanho_lote=TAMANHO_LOTE_CHECKPOINT,
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_com_checkpoint(
+        setor_bairro_correcao, df, diretorio, tamanho_lote,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_setor=caminho_arquivo_setor,
+        caminho_arquivo_bairro=caminho_arquivo_bairro, nome_coluna_log=nome_coluna_log,
+        nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_sfiscal=nome_coluna_sfiscal, nome_coluna_bairro=nome_coluna_bairro,
+        coluna_codlog_eixos=coluna_codlog_eixos, encoding_eixos=encoding_eixos, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
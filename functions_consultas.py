@@ -0,0 +1,302 @@
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from functions_cache import cache_consulta_obter, cache_consulta_gravar, modo_offline
+from functions_importacao import modulo_tardio
+
+
+# requests e geopy só são carregados na primeira consulta
+requests = modulo_tardio('requests')
+requests_adapters = modulo_tardio('requests.adapters')
+geopy_exc = modulo_tardio('geopy.exc')
+geopy_geocoders = modulo_tardio('geopy.geocoders')
+
+
+# endereço base do ViaCEP (pode ser trocado por um servidor local nos testes)
+URL_VIACEP = 'https://viacep.com.br/ws'
+
+
+# limite do Nominatim público: 1 requisição por segundo
+REQUISICOES_POR_SEGUNDO_NOMINATIM = 1
+
+# geocodificadores e limitadores reaproveitados entre chamadas
+_geocodificadores = {}
+_limitadores = {}
+_trava_compartilhados = threading.Lock()
+
+
+# chave do cache de consultas para um CEP (apenas dígitos)
+def chave_cep(cep):
+    return re.sub(r'\D', '', str(cep))
+
+
+# chave do cache de consultas para uma busca de logradouro no ViaCEP
+def chave_logradouro(uf, cidade, nome_rua):
+    return f"{uf}/{cidade}/{nome_rua}".strip().lower()
+
+
+# endereço por extenso sem espaços repetidos (a chave de cache ignora maiúsculas/minúsculas)
+def normalizar_endereco(endereco):
+    return ' '.join(str(endereco).replace(' ,', ',').split()).strip(' ,')
+
+
+# chave do cache de consultas para um endereço geocodificado
+def chave_endereco(endereco, dominio=None):
+    return f"{dominio or 'nominatim'}|{normalizar_endereco(endereco).casefold()}"
+
+
+# Limitador de requisições por segundo, compartilhado entre threads
+# retorna uma função que bloqueia até a próxima requisição ser permitida
+def limitador_requisicoes(requisicoes_por_segundo):
+    intervalo = 1.0 / requisicoes_por_segundo if requisicoes_por_segundo else 0.0
+    trava = threading.Lock()
+    proxima = [time.monotonic()]
+
+    def aguardar():
+        with trava:
+            agora = time.monotonic()
+            espera = proxima[0] - agora
+            proxima[0] = max(proxima[0], agora) + intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+    return aguardar
+
+
+# Limitador único por nome de serviço e taxa, compartilhado por todas as chamadas do processo
+# (uma chamada com outra requisicoes_por_segundo ganha o seu próprio limitador em vez de herdar a primeira taxa)
+def limitador_compartilhado(nome, requisicoes_por_segundo):
+    chave = (nome, requisicoes_por_segundo)
+    with _trava_compartilhados:
+        if chave not in _limitadores:
+            _limitadores[chave] = limitador_requisicoes(requisicoes_por_segundo)
+        return _limitadores[chave]
+
+
+# Geocodificador Nominatim reaproveitado por usuário e endpoint
+# dominio/scheme permitem apontar para um Nominatim local (ex.: dominio='localhost:8080', scheme='http')
+def geocodificador(usuario, dominio=None, scheme=None):
+    chave = (usuario, dominio, scheme)
+    with _trava_compartilhados:
+        if chave not in _geocodificadores:
+            parametros = {'user_agent': usuario}
+            if dominio:
+                parametros['domain'] = dominio
+            if scheme:
+                parametros['scheme'] = scheme
+            _geocodificadores[chave] = geopy_geocoders.Nominatim(**parametros)
+        return _geocodificadores[chave]
+
+
+# Coordenadas (latitude, longitude) de um endereço, com cache de consultas e limite de requisições compartilhado
+# retorna None quando o endereço não é encontrado
+def geocodificar_endereco(endereco, usuario, dominio=None, scheme=None, tentativas=3, espera_inicial=1.0,
+                          usar_cache=True, offline=None, requisicoes_por_segundo=REQUISICOES_POR_SEGUNDO_NOMINATIM):
+    if tentativas < 1:
+        raise ValueError('tentativas deve ser pelo menos 1')
+    offline = modo_offline() if offline is None else offline
+    chave = chave_endereco(endereco, dominio)
+    if usar_cache:
+        encontrado, coordenadas = cache_consulta_obter('nominatim', chave, aceitar_expirado=offline)
+        if encontrado:
+            return tuple(coordenadas) if coordenadas is not None else None
+    if offline:
+        raise LookupError('endereço não está no cache (modo offline)')
+
+    geolocator = geocodificador(usuario, dominio, scheme)
+    aguardar = limitador_compartilhado(f"nominatim:{dominio or 'publico'}", requisicoes_por_segundo)
+    for tentativa in range(tentativas):
+        aguardar()
+        try:
+            location = geolocator.geocode(normalizar_endereco(endereco))
+            break
+        except (geopy_exc.GeocoderTimedOut, geopy_exc.GeocoderUnavailable):
+            if tentativa == tentativas - 1:
+                raise
+            time.sleep(espera_inicial * 2 ** tentativa)
+
+    coordenadas = (location.latitude, location.longitude) if location else None
+    if usar_cache:
+        cache_consulta_gravar('nominatim', chave, list(coordenadas) if coordenadas else None)
+    return coordenadas
+
+
+# Sessão http com pool de conexões reaproveitadas entre as requisições
+def criar_sessao(tamanho_pool=10):
+    sessao = requests.Session()
+    adaptador = requests_adapters.HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    return sessao
+
+
+# função auxiliar das consultas em lote
+# GET com limite de requisições e novas tentativas com espera exponencial (erros de conexão, 429 e 5xx)
+def _requisitar_json(sessao, url, aguardar, tentativas=3, espera_inicial=0.5, timeout=10):
+    if tentativas < 1:
+        raise ValueError('tentativas deve ser pelo menos 1')
+    for tentativa in range(tentativas):
+        aguardar()
+        try:
+            resposta = sessao.get(url, timeout=timeout)
+            if resposta.status_code == 429 or resposta.status_code >= 500:
+                raise requests.exceptions.HTTPError(f"HTTP {resposta.status_code}", response=resposta)
+            resposta.raise_for_status()
+            return resposta.json()
+        except requests.exceptions.HTTPError as e:
+            codigo = e.response.status_code if e.response is not None else None
+            if codigo is not None and codigo != 429 and codigo < 500:
+                raise
+            if tentativa == tentativas - 1:
+                raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if tentativa == tentativas - 1:
+                raise
+        time.sleep(espera_inicial * 2 ** tentativa)
+
+
+# função auxiliar das consultas em lote
+# executa consultar(item) para cada item distinto em paralelo e devolve dict item -> (situacao, valor, erro)
+def _consultar_em_paralelo(itens, consultar, max_workers):
+    def consultar_item(item):
+        try:
+            valor = consultar(item)
+            return item, ('ok' if valor is not None else 'nao_encontrado', valor, None)
+        except Exception as e:
+            return item, ('erro', None, f"{type(e).__name__}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(consultar_item, itens))
+
+
+# Consulta de vários CEPs de uma vez no ViaCEP
+# aceita lista/Series de CEPs ou DataFrame com a coluna coluna_cep; CEPs repetidos são consultados uma única vez
+# retorna um DataFrame na ordem da entrada com cep, logradouro, bairro, cidade, uf, situacao e erro (pronto para verifica_cep_bairro)
+def resolver_ceps_lote(ceps, coluna_cep='cep', url_base=URL_VIACEP, requisicoes_por_segundo=5, max_workers=8,
+                       tentativas=3, usar_cache=True, offline=None, sessao=None):
+    offline = modo_offline() if offline is None else offline
+    if isinstance(ceps, pd.DataFrame):
+        ceps = ceps[coluna_cep]
+    chaves = [chave_cep(cep) for cep in ceps]
+    sessao = sessao or criar_sessao(max_workers)
+    aguardar = limitador_requisicoes(requisicoes_por_segundo)
+
+    def consultar(chave):
+        if usar_cache:
+            encontrado, endereco = cache_consulta_obter('cep', chave, aceitar_expirado=offline)
+            if encontrado:
+                return endereco
+        if offline:
+            raise LookupError('CEP não está no cache (modo offline)')
+        dados = _requisitar_json(sessao, f"{url_base}/{chave}/json/", aguardar, tentativas)
+        # mesmo formato do brazilcep, para compartilhar o cache com a endereco_por_cep
+        endereco = None if dados.get('erro') else {
+            'cep': dados.get('cep', '').replace('-', ''),
+            'street': dados.get('logradouro', ''),
+            'complement': dados.get('complemento', ''),
+            'district': dados.get('bairro', ''),
+            'city': dados.get('localidade', ''),
+            'uf': dados.get('uf', ''),
+        }
+        if usar_cache:
+            cache_consulta_gravar('cep', chave, endereco)
+        return endereco
+
+    respostas = _consultar_em_paralelo(list(dict.fromkeys(chaves)), consultar, max_workers)
+
+    linhas = []
+    for chave in chaves:
+        situacao, endereco, erro = respostas[chave]
+        endereco = endereco or {}
+        linhas.append({
+            'cep': chave,
+            'logradouro': endereco.get('street'),
+            'bairro': endereco.get('district'),
+            'cidade': endereco.get('city'),
+            'uf': endereco.get('uf'),
+            'situacao': situacao,
+            'erro': erro,
+        })
+    return pd.DataFrame(linhas, columns=['cep', 'logradouro', 'bairro', 'cidade', 'uf', 'situacao', 'erro'])
+
+
+# Busca de CEPs por logradouro (uf, cidade, rua) em lote no ViaCEP
+# aceita lista de triplas ou DataFrame com as colunas uf, cidade e rua; triplas repetidas são consultadas uma única vez
+# retorna um DataFrame com uma linha por CEP encontrado (uf, cidade, rua, cep, bairro, situacao, erro)
+def resolver_logradouros_lote(triplas, url_base=URL_VIACEP, requisicoes_por_segundo=5, max_workers=8,
+                              tentativas=3, usar_cache=True, offline=None, sessao=None):
+    offline = modo_offline() if offline is None else offline
+    if isinstance(triplas, pd.DataFrame):
+        triplas = triplas[['uf', 'cidade', 'rua']].itertuples(index=False, name=None)
+    triplas = [tuple(tripla) for tripla in triplas]
+    sessao = sessao or criar_sessao(max_workers)
+    aguardar = limitador_requisicoes(requisicoes_por_segundo)
+
+    def consultar(tripla):
+        uf, cidade, nome_rua = tripla
+        chave = chave_logradouro(uf, cidade, nome_rua)
+        if usar_cache:
+            encontrado, resultados_ceps = cache_consulta_obter('viacep', chave, aceitar_expirado=offline)
+            if encontrado:
+                return resultados_ceps
+        if offline:
+            raise LookupError('logradouro não está no cache (modo offline)')
+        url = f"{url_base}/{uf}/{urllib.parse.quote(cidade)}/{urllib.parse.quote(nome_rua)}/json/"
+        dados = _requisitar_json(sessao, url, aguardar, tentativas)
+        resultados_ceps = None
+        if isinstance(dados, list) and len(dados) > 0:
+            resultados_ceps = [{'cep': enderecos['cep'], 'bairro': enderecos['bairro']} for enderecos in dados]
+        if usar_cache:
+            cache_consulta_gravar('viacep', chave, resultados_ceps)
+        return resultados_ceps
+
+    respostas = _consultar_em_paralelo(list(dict.fromkeys(triplas)), consultar, max_workers)
+
+    linhas = []
+    for uf, cidade, nome_rua in triplas:
+        situacao, resultados_ceps, erro = respostas[(uf, cidade, nome_rua)]
+        base = {'uf': uf, 'cidade': cidade, 'rua': nome_rua, 'situacao': situacao, 'erro': erro}
+        if resultados_ceps:
+            linhas.extend({**base, 'cep': item['cep'], 'bairro': item['bairro']} for item in resultados_ceps)
+        else:
+            linhas.append({**base, 'cep': None, 'bairro': None})
+    return pd.DataFrame(linhas, columns=['uf', 'cidade', 'rua', 'cep', 'bairro', 'situacao', 'erro'])
+
+
+# Geocodificação de vários endereços numa única passada
+# endereços são normalizados e os repetidos consultados uma única vez, respeitando o limite de requisições do Nominatim
+# retorna um DataFrame na ordem da entrada com endereco, latitude, longitude, situacao e erro
+def coordenadas_por_endereco_lote(enderecos, usuario, coluna_endereco='endereco', dominio=None, scheme=None,
+                                  usar_cache=True, offline=None, requisicoes_por_segundo=REQUISICOES_POR_SEGUNDO_NOMINATIM):
+    if isinstance(enderecos, pd.DataFrame):
+        enderecos = enderecos[coluna_endereco]
+    enderecos = list(enderecos)
+    chaves = [chave_endereco(endereco, dominio) for endereco in enderecos]
+    unicos = dict(zip(chaves, enderecos))
+
+    respostas = {}
+    for chave, endereco in unicos.items():
+        try:
+            coordenadas = geocodificar_endereco(
+                endereco, usuario, dominio, scheme, usar_cache=usar_cache, offline=offline,
+                requisicoes_por_segundo=requisicoes_por_segundo)
+            respostas[chave] = ('ok' if coordenadas else 'nao_encontrado', coordenadas, None)
+        except Exception as e:
+            respostas[chave] = ('erro', None, f"{type(e).__name__}: {e}")
+
+    linhas = []
+    for endereco, chave in zip(enderecos, chaves):
+        situacao, coordenadas, erro = respostas[chave]
+        linhas.append({
+            'endereco': endereco,
+            'latitude': coordenadas[0] if coordenadas else None,
+            'longitude': coordenadas[1] if coordenadas else None,
+            'situacao': situacao,
+            'erro': erro,
+        })
+    return pd.DataFrame(linhas, columns=['endereco', 'latitude', 'longitude', 'situacao', 'erro'])
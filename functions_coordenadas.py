@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from functions_importacao import modulo_tardio
+from functions_log import contar, obter_logger
+
+
+logger = obter_logger('coordenadas')
+pyproj = modulo_tardio('pyproj')
+
+# extensão do município de Salvador em EPSG:31984 (xmin, ymin, xmax, ymax), com margem de alguns km
+EXTENSAO_SALVADOR = (525000, 8550000, 585000, 8600000)
+# situações de uma coordenada; só 'ok' (e 'invertida'/'graus' corrigidas) seguem para o cruzamento espacial
+SITUACOES_COORDENADA = ('ok', 'ausente', 'invalida', 'zerada', 'invertida', 'graus', 'fora_da_extensao')
+
+
+# função auxiliar da normalizar_coordenadas
+# texto com vírgula decimal (ou separador de milhar '.' junto da vírgula) para float; o que não for número vira NaN
+def _coluna_numerica(valores):
+    if pd.api.types.is_numeric_dtype(valores):
+        return valores.astype(float)
+    texto = valores.astype(str).str.strip()
+    milhar = texto.str.contains(',', regex=False) & texto.str.contains('.', regex=False)
+    texto = texto.where(~milhar, texto.str.replace('.', '', regex=False))
+    return pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce').astype(float)
+
+
+# função auxiliar da normalizar_coordenadas
+def _dentro(x, y, extensao):
+    xmin, ymin, xmax, ymax = extensao
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+# Coordenadas sedur de todo o DataFrame normalizadas de uma vez, antes de qualquer cruzamento espacial
+# aceita vírgula decimal e classifica cada linha (coluna situacao):
+#   ausente (x ou y vazio), invalida (não é número), zerada, graus (latitude/longitude numa coluna UTM),
+#   invertida (x e y trocados), fora_da_extensao (fora de extensao, em EPSG:31984) ou ok
+# com corrigir, coordenadas invertidas são destrocadas e as em graus reprojetadas para EPSG:31984 (e aceitas se caírem na extensão)
+# extensao=None desliga a verificação de extensão (e a detecção de eixos trocados)
+# retorna DataFrame com o índice de df e as colunas x, y (NaN quando não aproveitáveis), situacao e valida
+def normalizar_coordenadas(df, coord_x, coord_y, extensao=EXTENSAO_SALVADOR, corrigir=False):
+    if coord_x not in df.columns or coord_y not in df.columns:
+        return pd.DataFrame({'x': np.nan, 'y': np.nan, 'situacao': 'ausente', 'valida': False}, index=df.index)
+
+    ausente = (df[coord_x].isna() | df[coord_y].isna()).to_numpy()
+    x = _coluna_numerica(df[coord_x]).to_numpy(copy=True)
+    y = _coluna_numerica(df[coord_y]).to_numpy(copy=True)
+    situacao = np.full(len(df), 'ok', dtype=object)
+    with np.errstate(invalid='ignore'):
+        invalida = ~ausente & (np.isnan(x) | np.isnan(y) | np.isinf(x) | np.isinf(y))
+        zerada = ~ausente & ~invalida & ((x == 0) | (y == 0))
+        graus = ~ausente & ~invalida & ~zerada & (np.abs(x) <= 180) & (np.abs(y) <= 180)
+        resto = ~ausente & ~invalida & ~zerada & ~graus
+        if extensao is not None:
+            dentro = _dentro(x, y, extensao)
+            invertida = resto & ~dentro & _dentro(y, x, extensao)
+            fora = resto & ~dentro & ~invertida
+        else:
+            invertida = fora = np.zeros(len(df), dtype=bool)
+    situacao[ausente] = 'ausente'
+    situacao[invalida] = 'invalida'
+    situacao[zerada] = 'zerada'
+    situacao[graus] = 'graus'
+    situacao[invertida] = 'invertida'
+    situacao[fora] = 'fora_da_extensao'
+    valida = situacao == 'ok'
+
+    if corrigir:
+        x[invertida], y[invertida] = y[invertida], x[invertida].copy()
+        valida = valida | invertida
+        if graus.any():
+            # longitude/latitude (ou latitude/longitude trocadas) reprojetadas para UTM 24S
+            # a maior em módulo é a longitude (em Salvador, cerca de -38,5 contra -13 da latitude)
+            transformador = pyproj.Transformer.from_crs('EPSG:4326', 'EPSG:31984', always_xy=True)
+            lon_lat = np.abs(x[graus]) >= np.abs(y[graus])
+            lon, lat = np.where(lon_lat, x[graus], y[graus]), np.where(lon_lat, y[graus], x[graus])
+            x_utm, y_utm = transformador.transform(lon, lat)
+            x[graus], y[graus] = x_utm, y_utm
+            aceita = np.ones(len(x_utm), dtype=bool) if extensao is None else _dentro(x_utm, y_utm, extensao)
+            valida[np.flatnonzero(graus)[aceita]] = True
+            situacao[np.flatnonzero(graus)[~aceita]] = 'fora_da_extensao'
+
+    x[~valida] = np.nan
+    y[~valida] = np.nan
+    resultado = pd.DataFrame({'x': x, 'y': y, 'situacao': situacao, 'valida': valida}, index=df.index)
+
+    # triagem em lote: contadores por situação e um resumo no log
+    problemas = resultado['situacao'][resultado['situacao'].isin(SITUACOES_COORDENADA[2:])].value_counts()
+    for nome, quantidade in problemas.items():
+        contar(f"coordenada_{nome}", quantidade)
+    if len(problemas):
+        logger.info("Coordenadas sedur com problema%s: %s", ' (corrigidas quando possível)' if corrigir else '',
+                    problemas.to_dict(), extra={'situacoes': problemas.to_dict()})
+    return resultado
@@ -1,22 +1,58 @@
-from geopy.geocoders import Nominatim
-import geopandas as gpd
-from shapely.geometry import Point, LineString, Polygon
-import osmnx as ox
-import brazilcep
-import requests
 import pandas as pd
+import numpy as np
 import urllib.parse
-import folium
 import re
+import io
+import time
+from psycopg2 import sql
+from functions_cache import carregar_camada, cache_consulta_obter, cache_consulta_gravar, modo_offline
+from functions_consultas import URL_VIACEP, chave_cep, chave_logradouro, geocodificar_endereco
+from functions_nomes import buscar_nome_logradouro, construir_indice_nomes
+from functions_osm import comprimento_rua
+from functions_logradouros import (carregar_indice_logradouros, carregar_poligonos_por_logradouro, ponto_numero_porta,
+                                   pontos_numero_porta)
+from functions_verticais import obter_conexao
+from functions_saida import ColetorResultados
+from functions_log import Progresso, contar, etapa, metricas, obter_logger
+from functions_importacao import modulo_tardio
+from functions_coordenadas import EXTENSAO_SALVADOR, normalizar_coordenadas
+
+
+logger = obter_logger('validacao')
+
+# dependências pesadas carregadas no primeiro uso (consultas ao banco e ao cache não pagam a importação)
+gpd = modulo_tardio('geopandas')
+shapely = modulo_tardio('shapely')
+ox = modulo_tardio('osmnx')
+brazilcep = modulo_tardio('brazilcep')
+requests = modulo_tardio('requests')
 
 
 # Endereço por número do cep
-def endereco_por_cep(cep):
+# as respostas (inclusive "não encontrado") ficam no cache de consultas; no modo offline só o cache é usado
+def endereco_por_cep(cep, usar_cache=True, offline=None):
+    offline = modo_offline() if offline is None else offline
+    chave = chave_cep(cep)
+    if usar_cache:
+        encontrado, endereco = cache_consulta_obter('cep', chave, aceitar_expirado=offline)
+        if encontrado:
+            return endereco
+    if offline:
+        logger.warning("CEP %s não está no cache (modo offline).", cep)
+        return None
     try:
         endereco = brazilcep.get_address_from_cep(cep)
+        if usar_cache:
+            cache_consulta_gravar('cep', chave, endereco)
         return endereco
+    except (brazilcep.exceptions.CEPNotFound, brazilcep.exceptions.InvalidCEP) as e:
+        logger.info("CEP não encontrado: %s", e)
+        if usar_cache:
+            cache_consulta_gravar('cep', chave, None)
+        return None
     except Exception as e:
-        print(f"Erro ao consultar CEP: {e}")
+        logger.exception("Erro ao consultar CEP %s: %s", cep, e)
+        contar('erros')
         return None
 
 
@@ -26,68 +62,95 @@ def verifica_cep_bairro(dicionario_ceps, nome_bairro):
     filtro_bairro = df_cep[df_cep['bairro'] == nome_bairro]
     if not filtro_bairro.empty:
         cep_final = filtro_bairro['cep'].tolist()
-        print(cep_final)
+        logger.info("CEPs do bairro %s: %s", nome_bairro, cep_final)
         return cep_final
 
 
 # função auxiliar da verifica_metragem_log_e_numero_porta
 # Coordenadas por endereço por extenso
-def coordenadas_por_endereco(localizacao, usuario):
-    geolocator = Nominatim(user_agent=usuario)
-    location = geolocator.geocode(localizacao)
-    if location:
-        return (location.latitude, location.longitude)
+# o geocodificador é reaproveitado entre chamadas e as respostas ficam no cache de consultas
+def coordenadas_por_endereco(localizacao, usuario, usar_cache=True, offline=None):
+    try:
+        coordenadas = geocodificar_endereco(localizacao, usuario, usar_cache=usar_cache, offline=offline)
+    except Exception as e:
+        logger.exception("Erro ao consultar endereço: %s", e)
+        contar('erros')
+        return None
+    if coordenadas:
+        return coordenadas
     else:
-        print("Endereço não encontrado")
+        logger.info("Endereço não encontrado: %s", localizacao)
         return None
 
 
 # Verifica o número de porta em relação a metragem do logradouro
-def verifica_metragem_log_e_numero_porta(cep, numero, usuario):
+# com indice_comprimentos (carregar_indice_comprimento_ruas) o comprimento vem do índice da cidade, sem baixar o grafo
+def verifica_metragem_log_e_numero_porta(cep, numero, usuario, indice_comprimentos=None):
     endereco = endereco_por_cep(cep)
-    if cep:
+    if endereco:
         rua = endereco['street']
         bairro = endereco['district']
         cidade = endereco['city']
         estado = endereco['uf']
         endereco_completo = f"{rua}, {bairro}, {cidade}, {estado}, Brasil"
-        coordenadas = coordenadas_por_endereco(endereco_completo, usuario)
 
-        if coordenadas:
+        if indice_comprimentos is not None:
+            # consulta offline no índice de comprimentos da cidade
+            street_length = comprimento_rua(indice_comprimentos, rua, bairro)
+            if street_length is None:
+                logger.warning("Não foi possível encontrar a %s no índice de comprimentos", rua)
+                return
+        else:
+            coordenadas = coordenadas_por_endereco(endereco_completo, usuario)
+            if not coordenadas:
+                logger.warning("Não foi possível obter as coordenadas para o endereço %s", endereco_completo)
+                return
+
             latitude, longitude = coordenadas
             # baixar os dados do log usando osmnx
             graph = ox.graph_from_point(
                 (latitude, longitude), dist=1000, network_type='all', simplify=True)
             # Converter p GeoDataFrames
             nodes, edges = ox.graph_to_gdfs(graph)
-            # filtrar p acessar a rua desejada
-            street_edges = edges[edges['name'].str.contains(
-                rua, case=False, na=False)]
-
-            if not street_edges.empty:
-                # calcular o comprimento total do log
-                street_length = street_edges['length'].sum()
-                print(f"Comprimento da {rua}: {street_length} metros")
-                if numero > street_length:
-                    print(
-                        'Número de porta maior que o comprimento do logradouro, probabilidade de estar errado')
-                else:
-                    print(f'Número de porta {
-                        numero} é válido para o comprimento do logradouro')
+            # filtrar p acessar a rua desejada (nome normalizado, exato ou aproximado, sem regex)
+            edges = edges.explode('name')
+            correspondencia = buscar_nome_logradouro(construir_indice_nomes(edges['name'].dropna().unique()), rua)
+            if correspondencia:
+                street_edges = edges[edges['name'].isin(correspondencia[1])]
+                street_edges = street_edges[~street_edges.index.duplicated()]
             else:
-                print(f"Não foi possível encontrar a {
-                      rua} em {endereco_completo}")
+                street_edges = edges.iloc[:0]
+
+            if street_edges.empty:
+                logger.warning("Não foi possível encontrar a %s em %s", rua, endereco_completo)
+                return
+            # calcular o comprimento total do log
+            street_length = street_edges['length'].sum()
+
+        logger.info("Comprimento da %s: %s metros", rua, street_length)
+        if numero > street_length:
+            logger.warning('Número de porta maior que o comprimento do logradouro, probabilidade de estar errado')
         else:
-            print("Não foi possível obter as coordenadas para o endereço")
+            logger.info('Número de porta %s é válido para o comprimento do logradouro', numero)
     else:
-        print("Não foi possível obter dados para o endereço")
+        logger.warning("Não foi possível obter dados para o endereço do CEP %s", cep)
 
 
 # Encontra cep de acordo com o nome do logradouro
-def verifica_log_cep(uf, cidade, nome_rua):
+# as respostas (inclusive "não encontrado") ficam no cache de consultas; no modo offline só o cache é usado
+def verifica_log_cep(uf, cidade, nome_rua, usar_cache=True, offline=None):
+    offline = modo_offline() if offline is None else offline
+    chave = chave_logradouro(uf, cidade, nome_rua)
+    if usar_cache:
+        encontrado, resultados_ceps = cache_consulta_obter('viacep', chave, aceitar_expirado=offline)
+        if encontrado:
+            return resultados_ceps
+    if offline:
+        logger.warning("Logradouro %s, %s não está no cache (modo offline).", nome_rua, cidade)
+        return None
     try:
         nome_rua_codificado = urllib.parse.quote(nome_rua)
-        url = f'https://viacep.com.br/ws/{uf}/{
+        url = f'{URL_VIACEP}/{uf}/{
             cidade}/{nome_rua_codificado}/json/'
         response = requests.get(url)
         response.raise_for_status()
@@ -100,15 +163,20 @@ def verifica_log_cep(uf, cidade, nome_rua):
                     'bairro': enderecos['bairro']
                 }
                 resultados_ceps.append(resultado)
+            if usar_cache:
+                cache_consulta_gravar('viacep', chave, resultados_ceps)
             return resultados_ceps
         else:
-            print(f"Não foi possível encontrar o CEP para {
-                  nome_rua}, {cidade}.")
+            logger.info("Não foi possível encontrar o CEP para %s, %s.", nome_rua, cidade)
+            if usar_cache:
+                cache_consulta_gravar('viacep', chave, None)
             return None
     except requests.exceptions.RequestException as req_err:
-        print(f'Erro de requisição ao consultar CEP: {req_err}')
+        logger.warning('Erro de requisição ao consultar CEP: %s', req_err)
+        contar('erros')
     except Exception as e:
-        print(f'Erro ao consultar CEP: {e}')
+        logger.exception('Erro ao consultar CEP: %s', e)
+        contar('erros')
     return None
 
 
@@ -117,7 +185,7 @@ def verifica_log_cep(uf, cidade, nome_rua):
 def inverter_coordenadas(geom):
     if geom and geom.geom_type == 'LineString':
         coords_invertidas = [(p[1], p[0]) for p in geom.coords]
-        return LineString(coords_invertidas)
+        return shapely.LineString(coords_invertidas)
     else:
         return geom
 # for codlog in coluna_log
@@ -126,60 +194,63 @@ def inverter_coordenadas(geom):
 # Coordenadas de acordo com a extensão do shp do logradouro e número de porta
 
 
-def coordenada_numero_porta(caminho_pc, df):
-    # abrindo shapefile pelo caminho do arquivo
-    ssa_eixos = gpd.read_file(caminho_pc, crs='EPSG:31984')
+# com saida (ColetorResultados) as linhas vão para o coletor em vez da lista devolvida
+def coordenada_numero_porta(caminho_pc, df, saida=None):
+    # índice de logradouros em utm (codlog -> linha encadeada com comprimentos acumulados), montado uma vez por versão do shapefile
+    with etapa('indice_logradouros'):
+        indice = carregar_indice_logradouros(caminho_pc, 'codlog', renomear={'CodLog': 'codlog'})
     resultados = []
+    progresso = Progresso(len(df), 'coordenada_numero_porta')
 
     for index, row in df.iterrows():
-        print(f"Processando linha {index}...")
+        progresso.avancar()
+        logger.debug("Processando linha %s...", index)
         codlog = row['cod._logradouro_localização']
         codlog = int(re.sub(r'-\d+', '', codlog))
 
-        # convertendo para lat_long
-        logradouro = ssa_eixos[ssa_eixos['CodLog'] == codlog]
-        logradouro = logradouro.to_crs('EPSG: 4326')
-
-        if logradouro.empty:
-            print(f"Logradouro {codlog} não encontrado no shapefile.")
-            continue
-        # invertendo coordenadas para visualização
-        gdf_coord_invertido = logradouro.copy()
-        gdf_coord_invertido['geometry'] = logradouro['geometry'].apply(
-            inverter_coordenadas)
-
-        # geodataframe em utm
-        logradouro_utm = logradouro.to_crs('EPSG:31984')
-
         # transformando distância nº métrico compatível a unidade de medida do logradouro
         numero = row['nº_métrico_localização']
         distancia_em_metros = (numero)/100000
-        # interpolando a distância conforme a distância do número métrico do início do logradouro
-        # em lat long para visualizar
-        # interpolacao = gdf_coord_invertido.interpolate(distancia_em_metros)
-
-        # em utm
-        interpolacao_utm = logradouro_utm.interpolate(distancia_em_metros)
-        if interpolacao_utm.empty:
-            print(
-                f"Número de porta maior que o comprimento do logradouro encontrado no shapefile.")
+
+        # interpolando a distância conforme a distância do número métrico do início do logradouro (em utm)
+        with etapa('interpolacao'):
+            interpolacao_utm = ponto_numero_porta(indice, codlog, distancia_em_metros)
+        if interpolacao_utm is None:
+            logger.debug("Logradouro %s não encontrado no shapefile.", codlog, extra={'codlog': codlog})
+            contar('logradouro_nao_encontrado')
+            continue
+        x_interpolado, y_interpolado, alem_do_fim = interpolacao_utm
+        if alem_do_fim:
+            logger.debug("Número de porta maior que o comprimento do logradouro encontrado no shapefile.",
+                         extra={'codlog': codlog, 'numero': numero})
+            contar('alem_do_fim')
             continue
 
-        try:
-            coordenada_final = (round(interpolacao_utm.geometry.x.iloc[0], 3),
-                                round(interpolacao_utm.geometry.y.iloc[0], 3))
-
-            resultado_com_coord = row.copy()
-            resultado_com_coord['x_gove'] = coordenada_final[0]
-            resultado_com_coord['y_gove'] = coordenada_final[1]
-            resultado_com_coord['diferenca_x'] = (
-                resultado_com_coord['x_gove'] - resultado_com_coord['coordenada_x'])
-            resultado_com_coord['diferenca_y'] = (
-                resultado_com_coord['y_gove'] - resultado_com_coord['coordenada_y'])
-            resultados.append(resultado_com_coord)
-        except IndexError:
+        coordenada_final = (round(x_interpolado, 3), round(y_interpolado, 3))
+        contar('coordenada_calculada')
+
+        if saida is not None:
+            with etapa('saida'):
+                saida.adicionar(
+                    row, x_gove=coordenada_final[0], y_gove=coordenada_final[1],
+                    diferenca_x=coordenada_final[0] - row['coordenada_x'],
+                    diferenca_y=coordenada_final[1] - row['coordenada_y'])
             continue
 
+        resultado_com_coord = row.copy()
+        resultado_com_coord['x_gove'] = coordenada_final[0]
+        resultado_com_coord['y_gove'] = coordenada_final[1]
+        resultado_com_coord['diferenca_x'] = (
+            resultado_com_coord['x_gove'] - resultado_com_coord['coordenada_x'])
+        resultado_com_coord['diferenca_y'] = (
+            resultado_com_coord['y_gove'] - resultado_com_coord['coordenada_y'])
+        resultados.append(resultado_com_coord)
+    progresso.concluir()
+
+    if saida is not None:
+        with etapa('saida'):
+            saida.descarregar()
+        return saida
     return resultados
 
     # para visualizar no mapa
@@ -198,246 +269,485 @@ def coordenada_numero_porta(caminho_pc, df):
 
     # return coordenada_final
 
+
+# Coordenadas por número de porta em lote (operações por coluna, sem iterrows)
+# mesma regra da coordenada_numero_porta: distância nº métrico/100000 ao longo do logradouro indexado
+# com saida (ColetorResultados) o resultado vai para o coletor, que é devolvido
+def coordenada_numero_porta_lote(caminho_pc, df, saida=None):
+    # índice de logradouros do shapefile, montado uma vez por versão do arquivo
+    with etapa('indice_logradouros'):
+        indice = carregar_indice_logradouros(caminho_pc, 'codlog', renomear={'CodLog': 'codlog'})
+
+    # normalizando todos os codlogs de uma vez (remove o dígito após o '-')
+    codlogs = pd.to_numeric(
+        df['cod._logradouro_localização'].astype(str).str.replace(r'-\d+', '', regex=True),
+        errors='coerce')
+    numeros = pd.to_numeric(df['nº_métrico_localização'], errors='coerce')
+
+    # busca binária no índice para todos os pontos, agrupados por codlog
+    with etapa('interpolacao'):
+        pontos = pontos_numero_porta(indice, codlogs, numeros / 100000)
+
+    nao_encontrados = codlogs[~pontos['encontrado']].dropna().unique()
+    contar('logradouro_nao_encontrado', (~pontos['encontrado']).sum())
+    contar('alem_do_fim', pontos['alem_do_fim'].sum())
+    if len(nao_encontrados) > 0:
+        logger.info("%d logradouros não encontrados no shapefile.", len(nao_encontrados))
+    if pontos['alem_do_fim'].any():
+        logger.info("%d números de porta maiores que o comprimento do logradouro.", pontos['alem_do_fim'].sum())
+
+    encontrados = (pontos['encontrado'] & ~pontos['alem_do_fim'] & numeros.notna()).to_numpy()
+    contar('coordenada_calculada', encontrados.sum())
+    resultado = df.loc[encontrados].copy()
+    resultado['x_gove'] = pontos['x'].to_numpy()[encontrados].round(3)
+    resultado['y_gove'] = pontos['y'].to_numpy()[encontrados].round(3)
+    resultado['diferenca_x'] = resultado['x_gove'] - resultado['coordenada_x']
+    resultado['diferenca_y'] = resultado['y_gove'] - resultado['coordenada_y']
+    if saida is not None:
+        with etapa('saida'):
+            saida.adicionar_df(resultado)
+        return saida
+    return resultado
+
 # geometria setor fiscal + logradouro sedur medicao + interpolar/intersecção logradouro e setor fiscal
 # pegar a coordenada do imovel e interpolar o setor fiscal
-def setor_fiscal_correto(caminho_arquivo_log, caminho_arquivo_setor, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, df):
+# as linhas sinalizadas são coletadas coluna a coluna; com saida (ColetorResultados) vão para o coletor, que é devolvido
+def setor_fiscal_correto(caminho_arquivo_log, caminho_arquivo_setor, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, df, comprimento_minimo=0.0, saida=None,
+                         extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
     # abrindo shapefiles (.shp) pelo caminho do arquivo
-    ssa_eixos = gpd.read_file(caminho_arquivo_log, crs='EPSG:31984')
-    ssa_setor_fiscal = gpd.read_file(caminho_arquivo_setor, crs='EPSG:31984')
-    resultados = []
+    with etapa('carregar_camadas'):
+        ssa_setor_fiscal = carregar_camada(caminho_arquivo_setor)
+    # índice de logradouros por codlog (montado uma vez por versão dos eixos)
+    with etapa('indice_logradouros'):
+        indice = carregar_indice_logradouros(caminho_arquivo_log, 'codlog')
+    # setores cruzados por cada logradouro (tabela de sobreposição pré-calculada)
+    with etapa('sobreposicao'):
+        setores_por_logradouro = carregar_poligonos_por_logradouro(
+            caminho_arquivo_log, 'codlog', caminho_arquivo_setor, 'Name', comprimento_minimo=comprimento_minimo)
+    resultados = saida if saida is not None else ColetorResultados()
+    if saida is not None:
+        saida.prever_colunas(list(df.columns) + ['geometry', 'setor_fiscal_novo', 'analise_manual'])
+    progresso = Progresso(len(df), 'setor_fiscal_correto')
+    # coordenadas sedur normalizadas de uma vez (vírgula decimal, eixos trocados, graus, fora da extensão)
+    coordenadas = normalizar_coordenadas(df, coord_x, coord_y, extensao, corrigir_coordenadas)
+    situacoes, xs, ys = coordenadas['situacao'].to_numpy(), coordenadas['x'].to_numpy(), coordenadas['y'].to_numpy()
 
     # localizando logradouro
-    for index, row in df.iterrows():
-        print(f"Processando linha {index}...")
+    for posicao, (index, row) in enumerate(df.iterrows()):
+        progresso.avancar()
+        logger.debug("Processando linha %s...", index)
         codlog = row[nome_coluna_log]
 
-        # convertendo para lat_long
-        logradouro = ssa_eixos[ssa_eixos['codlog'] == codlog]
-        logradouro = logradouro.to_crs('EPSG:4326')
-
-        if logradouro.empty:
-            print(f"Logradouro {codlog} não encontrado no shapefile.")
+        with etapa('busca_logradouro'):
+            registro = indice.get(codlog)
+        if registro is None:
+            logger.debug("Logradouro %s não encontrado no shapefile.", codlog, extra={'codlog': codlog})
+            contar('logradouro_nao_encontrado')
             continue
 
-        # GDF em UTM
-        logradouro_utm = logradouro.to_crs('EPSG:31984')
-
         # transformando distância nº porta compatível à unidade de medida do logradouro em metros
         numero = row[nome_coluna_nporta]
         distancia_em_metros = numero / 100000
 
-        if pd.notna(row.get(coord_x)) and pd.notna(row.get(coord_y)):
+        if situacoes[posicao] != 'ausente':
+            if np.isnan(xs[posicao]):
+                # coordenada presente mas inaproveitável: já contada e informada pela normalizar_coordenadas
+                logger.debug("Coordenada sedur da linha %s descartada (%s).", index, situacoes[posicao],
+                             extra={'codlog': codlog})
+                continue
             try:
-                # corrigindo o formato das coordenadas
-                coord_x_val = float(str(row[coord_x]).replace(',', '.'))
-                coord_y_val = float(str(row[coord_y]).replace(',', '.'))
-
                 # localizando o imóvel por coordenada
-                coordenada_existente = (coord_x_val, coord_y_val)
+                coordenada_existente = (xs[posicao], ys[posicao])
                 localizacao = pd.DataFrame([row])
-                localizacao['coordenadas'] = [Point(coordenada_existente)]
+                localizacao['coordenadas'] = [shapely.Point(coordenada_existente)]
                 localizacao = gpd.GeoDataFrame(localizacao, geometry='coordenadas', crs='EPSG:31984')
 
                 # interseção entre ponto e polígono de setores fiscais
-                intersecao_coord_existente = gpd.sjoin(localizacao, ssa_setor_fiscal, how='inner', predicate='within')
+                with etapa('sjoin'):
+                    intersecao_coord_existente = gpd.sjoin(localizacao, ssa_setor_fiscal, how='inner', predicate='within')
 
                 if not intersecao_coord_existente.empty:
                     setor_fiscal_encontrado = intersecao_coord_existente.iloc[0]['Name']
                     setor_fiscal_original = row[nome_coluna_sfiscal]
 
                     if setor_fiscal_original != setor_fiscal_encontrado:
-                        resultado_com_coord = pd.DataFrame([row])
-                        resultado_com_coord['setor_fiscal_novo'] = setor_fiscal_encontrado
-                        resultado_com_coord['analise_manual'] = 'nao'
-                        resultados.append(resultado_com_coord)
+                        contar('setor_alterado')
+                        with etapa('saida'):
+                            resultados.adicionar(row, setor_fiscal_novo=setor_fiscal_encontrado, analise_manual='nao')
             except (ValueError, IndexError) as e:
-                print(f"Erro ao processar coordenadas ou interseção: {e}")
+                logger.warning("Erro ao processar coordenadas ou interseção na linha %s: %s", index, e,
+                               extra={'codlog': codlog})
+                contar('coordenada_invalida')
                 continue
 
         else:
             if numero == 0:
                 # se não tiver nº de porta, verificar se o logradouro possui interseção com mais de um setor fiscal
-                intersecao_sem_n_porta = gpd.sjoin(logradouro, ssa_setor_fiscal, how='inner', predicate='within')
+                setores_encontrados = setores_por_logradouro.get(codlog, ())
                 try:
-                    if not intersecao_sem_n_porta.empty:
-                        setores_encontrados = intersecao_sem_n_porta['Name'].unique()
+                    if setores_encontrados:
                         if len(setores_encontrados) > 1:
-                            print(f"Logradouro {codlog} possui interseção com mais de um setor fiscal. Análise manual necessária.")
-                            resultado_sem_coord = pd.DataFrame([row])
-                            resultado_com_coord['setor_fiscal_novo'] = ''
-                            resultado_sem_coord['analise_manual'] = 'sim (sem nº porta e com mais de 1 setor fiscal por logradouro)'
-                            resultados.append(resultado_sem_coord)
+                            logger.debug("Logradouro %s possui interseção com mais de um setor fiscal. Análise manual necessária.",
+                                         codlog, extra={'codlog': codlog})
+                            contar('analise_manual')
+                            with etapa('saida'):
+                                resultados.adicionar(
+                                    row, setor_fiscal_novo='',
+                                    analise_manual='sim (sem nº porta e com mais de 1 setor fiscal por logradouro)')
                         else:
                             setor_fiscal_encontrado = setores_encontrados[0]
                             setor_fiscal_original = row[nome_coluna_sfiscal]
                             if setor_fiscal_original != setor_fiscal_encontrado:
-                                resultado_sem_coord = pd.DataFrame([row])
-                                resultado_sem_coord['setor_fiscal_novo'] = setor_fiscal_encontrado
-                                resultado_sem_coord['analise_manual'] = 'nao'
-                                resultados.append(resultado_sem_coord)
+                                contar('setor_alterado')
+                                with etapa('saida'):
+                                    resultados.adicionar(row, setor_fiscal_novo=setor_fiscal_encontrado, analise_manual='nao')
                 except IndexError:
                     continue
                 
             else:
                 # interpolando a distância
-                interpolacao_utm = logradouro_utm.interpolate(distancia_em_metros)
-                if interpolacao_utm.empty:
-                    print(f"Número de porta maior que o comprimento do logradouro encontrado no shapefile.")
+                with etapa('interpolacao'):
+                    x_interpolado, y_interpolado, alem_do_fim = ponto_numero_porta(indice, codlog, distancia_em_metros)
+                if alem_do_fim:
+                    logger.debug("Número de porta maior que o comprimento do logradouro encontrado no shapefile.",
+                                 extra={'codlog': codlog, 'numero': numero})
+                    contar('alem_do_fim')
                     continue
                 try:
-                    coordenada_final = (round(interpolacao_utm.geometry.x.iloc[0], 3), round(interpolacao_utm.geometry.y.iloc[0], 3))
-                    resultado_com_coord = pd.DataFrame([row])
-                    resultado_com_coord['geometry'] = [Point(coordenada_final)]
-                    resultado_com_coord = gpd.GeoDataFrame(resultado_com_coord, geometry='geometry', crs='EPSG:31984')
+                    coordenada_final = shapely.Point(round(x_interpolado, 3), round(y_interpolado, 3))
+                    localizacao = gpd.GeoDataFrame(geometry=[coordenada_final], crs='EPSG:31984')
                     # interseção com .shp de setor fiscal
-                    intersecao_com_n_porta = gpd.sjoin(resultado_com_coord, ssa_setor_fiscal, how='inner', predicate='within')
+                    with etapa('sjoin'):
+                        intersecao_com_n_porta = gpd.sjoin(localizacao, ssa_setor_fiscal, how='inner', predicate='within')
                     if not intersecao_com_n_porta.empty:
                         setor_fiscal_encontrado = intersecao_com_n_porta.iloc[0]['Name']
                         setor_fiscal_original = row[nome_coluna_sfiscal]
                         if setor_fiscal_original != setor_fiscal_encontrado:
-                            resultado_com_coord['setor_fiscal_novo'] = setor_fiscal_encontrado
-                            resultado_com_coord['analise_manual'] = 'sim (com nº porta e com mais de 1 setor fiscal por logradouro)'
-                            resultados.append(resultado_com_coord)
+                            contar('setor_alterado')
+                            contar('analise_manual')
+                            with etapa('saida'):
+                                resultados.adicionar(
+                                    row, geometry=coordenada_final, setor_fiscal_novo=setor_fiscal_encontrado,
+                                    analise_manual='sim (com nº porta e com mais de 1 setor fiscal por logradouro)')
                 except IndexError:
                     continue
+    progresso.concluir()
     # retornando resultados concatenados
-    if resultados:
-        return pd.concat(resultados, ignore_index=True)
+    if saida is not None:
+        with etapa('saida'):
+            saida.descarregar()
+        return saida
+    if len(resultados):
+        with etapa('saida'):
+            return resultados.resultado()
     else:
-        print("Nenhum resultado para concatenar.")
+        logger.info("Nenhum resultado para concatenar.")
         return pd.DataFrame()  # df vazio se não houver resultados
 
 
 # correçao de bairro
-def bairro_correcao(caminho_arquivo_log, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_bairro, df):
+# as linhas sinalizadas são coletadas coluna a coluna; com saida (ColetorResultados) vão para o coletor, que é devolvido
+def bairro_correcao(caminho_arquivo_log, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_bairro, df, comprimento_minimo=0.0, saida=None,
+                    extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
     # shapes
-    ssa_eixos = gpd.read_file(caminho_arquivo_log, encoding='latin1')
-    ssa_bairros = gpd.read_file(caminho_arquivo_bairro)
-    
-    print(ssa_eixos.columns)
-
-
-    resultados = []
+    with etapa('carregar_camadas'):
+        ssa_bairros = carregar_camada(caminho_arquivo_bairro)
+
+    # índice de logradouros em UTM (EPSG:31984), montado uma vez por versão dos eixos
+    with etapa('indice_logradouros'):
+        indice = carregar_indice_logradouros(caminho_arquivo_log, 'codlog', encoding='latin1', renomear={'CÃ³digo _1': 'codlog'})
+    # bairros cruzados por cada logradouro (tabela de sobreposição pré-calculada)
+    with etapa('sobreposicao'):
+        bairros_por_logradouro = carregar_poligonos_por_logradouro(
+            caminho_arquivo_log, 'CÃ³digo _1', caminho_arquivo_bairro, 'Bairro', encoding_eixos='latin1',
+            comprimento_minimo=comprimento_minimo)
+
+    resultados = saida if saida is not None else ColetorResultados()
+    if saida is not None:
+        saida.prever_colunas(list(df.columns) + ['geometry', 'bairro_novo', 'parametro', 'conclusão', 'analise_manual'])
+    progresso = Progresso(len(df), 'bairro_correcao')
+    # coordenadas sedur normalizadas de uma vez (vírgula decimal, eixos trocados, graus, fora da extensão)
+    coordenadas = normalizar_coordenadas(df, coord_x, coord_y, extensao, corrigir_coordenadas)
+    situacoes, xs, ys = coordenadas['situacao'].to_numpy(), coordenadas['x'].to_numpy(), coordenadas['y'].to_numpy()
 
     # localizando logradouro
-    for index, row in df.iterrows():
-        print(f"Processando linha {index}...")
+    for posicao, (index, row) in enumerate(df.iterrows()):
+        progresso.avancar()
+        logger.debug("Processando linha %s...", index)
         codlog = row[nome_coluna_log]
 
         # selecionando logradouro correspondente
-        logradouro = ssa_eixos[ssa_eixos['CÃ³digo _1'] == codlog]
-
-        if logradouro.empty:
-            print(f"Logradouro {codlog} não encontrado no shapefile.")
+        with etapa('busca_logradouro'):
+            registro = indice.get(codlog)
+        if registro is None:
+            logger.debug("Logradouro %s não encontrado no shapefile.", codlog, extra={'codlog': codlog})
+            contar('logradouro_nao_encontrado')
             continue
 
-        # logradouro para UTM (EPSG:31984)
-        logradouro_utm = logradouro.to_crs('EPSG:31984')
-
         # Distância com base no número de porta
         numero = row[nome_coluna_nporta]
         distancia_em_metros = pd.to_numeric(numero) / 100000  # Ajuste conforme a escala necessária
 
 
-        if pd.notna(row.get(coord_x)) and pd.notna(row.get(coord_y)):
+        if situacoes[posicao] != 'ausente':
+            if np.isnan(xs[posicao]):
+                # coordenada presente mas inaproveitável: já contada e informada pela normalizar_coordenadas
+                logger.debug("Coordenada sedur da linha %s descartada (%s).", index, situacoes[posicao],
+                             extra={'codlog': codlog})
+                continue
             try:
-                # corrigindo o formato das coordenadas
-                coord_x_val = float(str(row[coord_x]).replace(',', '.'))
-                coord_y_val = float(str(row[coord_y]).replace(',', '.'))
-
                 # criando GeoDataFrame a partir das coordenadas
-                localizacao = gpd.GeoDataFrame(df.iloc[[index]], geometry=gpd.points_from_xy([
-                                            coord_x_val], [coord_y_val]), crs='EPSG:31984')
+                localizacao = gpd.GeoDataFrame(df.iloc[[posicao]], geometry=gpd.points_from_xy([
+                                            xs[posicao]], [ys[posicao]]), crs='EPSG:31984')
 
                 # verificando interseção com bairros
-                intersecao_coord_existente = gpd.sjoin(
-                    localizacao, ssa_bairros, how='inner', predicate='intersects')
+                with etapa('sjoin'):
+                    intersecao_coord_existente = gpd.sjoin(
+                        localizacao, ssa_bairros, how='inner', predicate='intersects')
 
                 if not intersecao_coord_existente.empty:
                     bairro_encontrado = intersecao_coord_existente.iloc[0]['Bairro']
                     bairro_original = row[nome_coluna_bairro]
 
                     if bairro_original != bairro_encontrado:
-                        resultado_com_coord = pd.DataFrame([row])
-                        resultado_com_coord['bairro_novo'] = bairro_encontrado
-                        resultado_com_coord['parametro'] = 'coordenada sedur'
-                        resultado_com_coord['conclusão'] = 'bairro pela coordenada'
-                        resultado_com_coord['analise_manual'] = 'sim'
-                        resultados.append(resultado_com_coord)
+                        contar('bairro_alterado')
+                        contar('analise_manual')
+                        with etapa('saida'):
+                            resultados.adicionar(row, **{
+                                'bairro_novo': bairro_encontrado,
+                                'parametro': 'coordenada sedur',
+                                'conclusão': 'bairro pela coordenada',
+                                'analise_manual': 'sim'})
 
             except (ValueError, IndexError) as e:
-                print(f"Erro ao processar coordenadas ou interseção: {e}")
+                logger.warning("Erro ao processar coordenadas ou interseção na linha %s: %s", index, e,
+                               extra={'codlog': codlog})
+                contar('coordenada_invalida')
                 continue
 
         else:
             if numero == 0:
                 # verificar se o logradouro possui interseção com mais de um bairro
-                intersecao_sem_n_porta = gpd.sjoin(
-                    logradouro, ssa_bairros, how='inner', predicate='intersects')
+                bairros_encontrados = bairros_por_logradouro.get(codlog, ())
 
-                if not intersecao_sem_n_porta.empty:
-                    bairros_encontrados = intersecao_sem_n_porta['Bairro'].unique(
-                    )
+                if bairros_encontrados:
                     if len(bairros_encontrados) > 1:
-                        print(f"Logradouro {codlog} possui interseção com mais de um bairro. Análise manual necessária.")
-                        resultado_sem_coord = pd.DataFrame([row])
-                        resultado_sem_coord['bairro_novo'] = ''
-                        resultado_sem_coord['parametro'] = 'interseção logradouro x bairro'
-                        resultado_sem_coord['conclusão'] = 'logradouro com mais de 1 bairro. endereço sem nº de porta'
-                        resultado_sem_coord['analise_manual'] = 'sim'
-                        resultados.append(resultado_sem_coord)
+                        logger.debug("Logradouro %s possui interseção com mais de um bairro. Análise manual necessária.",
+                                     codlog, extra={'codlog': codlog})
+                        contar('analise_manual')
+                        with etapa('saida'):
+                            resultados.adicionar(row, **{
+                                'bairro_novo': '',
+                                'parametro': 'interseção logradouro x bairro',
+                                'conclusão': 'logradouro com mais de 1 bairro. endereço sem nº de porta',
+                                'analise_manual': 'sim'})
                     else:
                         bairro_encontrado = bairros_encontrados[0]
                         bairro_original = row[nome_coluna_bairro]
                         if bairro_original != bairro_encontrado:
-                            resultado_sem_coord = pd.DataFrame([row])
-                            resultado_sem_coord['bairro_novo'] = bairro_encontrado
-                            resultado_sem_coord['parametro'] = 'interseção logradouro x bairro'
-                            resultado_sem_coord['conclusão'] = 'logradouro pertencente a apenas 1 bairro. endereço sem nº de porta'
-                            resultado_sem_coord['analise_manual'] = 'nao'
-                            resultados.append(resultado_sem_coord)
+                            contar('bairro_alterado')
+                            with etapa('saida'):
+                                resultados.adicionar(row, **{
+                                    'bairro_novo': bairro_encontrado,
+                                    'parametro': 'interseção logradouro x bairro',
+                                    'conclusão': 'logradouro pertencente a apenas 1 bairro. endereço sem nº de porta',
+                                    'analise_manual': 'nao'})
 
             else:
                 # interpolando a distância para o número de porta
-                interpolacao_utm = logradouro_utm.interpolate(
-                    distancia_em_metros)
-                if interpolacao_utm.empty:
-                    print(
-                        f"Número de porta maior que o comprimento do logradouro encontrado no shapefile.")
+                with etapa('interpolacao'):
+                    x_interpolado, y_interpolado, alem_do_fim = ponto_numero_porta(
+                        indice, codlog, distancia_em_metros)
+                if alem_do_fim:
+                    logger.debug("Número de porta maior que o comprimento do logradouro encontrado no shapefile.",
+                                 extra={'codlog': codlog, 'numero': numero})
+                    contar('alem_do_fim')
                     continue
 
                 try:
                     # pegando a coordenada interpolada e criando GeoDataFrame
-                    coordenada_final = Point(
-                        interpolacao_utm.geometry.x.iloc[0], interpolacao_utm.geometry.y.iloc[0])
-                    resultado_com_coord = gpd.GeoDataFrame(
-                        [row], geometry=[coordenada_final], crs='EPSG:31984')
+                    coordenada_final = shapely.Point(x_interpolado, y_interpolado)
+                    localizacao = gpd.GeoDataFrame(geometry=[coordenada_final], crs='EPSG:31984')
 
                     # intersecao bairros com numero de porta
-                    intersecao_com_n_porta = gpd.sjoin(
-                        resultado_com_coord, ssa_bairros, how='inner', predicate='intersects')
+                    with etapa('sjoin'):
+                        intersecao_com_n_porta = gpd.sjoin(
+                            localizacao, ssa_bairros, how='inner', predicate='intersects')
                     if not intersecao_com_n_porta.empty:
                         bairro_encontrado = intersecao_com_n_porta.iloc[0]['Bairro']
                         bairro_original = row[nome_coluna_bairro]
 
                         if bairro_original != bairro_encontrado:
-                            resultado_com_coord['bairro_novo'] = bairro_encontrado
-                            resultado_com_coord['parametro'] = 'localização bairro pelo logradouro e nº de porta'
-                            resultado_com_coord['conclusão'] = 'bairro pelo endereço do imóvel'
-                            resultado_com_coord['analise_manual'] = 'nao'
-                            resultados.append(resultado_com_coord)
+                            contar('bairro_alterado')
+                            with etapa('saida'):
+                                resultados.adicionar(row, **{
+                                    'geometry': coordenada_final,
+                                    'bairro_novo': bairro_encontrado,
+                                    'parametro': 'localização bairro pelo logradouro e nº de porta',
+                                    'conclusão': 'bairro pelo endereço do imóvel',
+                                    'analise_manual': 'nao'})
 
                 except IndexError:
                     continue
+    progresso.concluir()
 
     # retornando os resultados concatenados
-    if resultados:
-        return pd.concat(resultados, ignore_index=True)
+    if saida is not None:
+        with etapa('saida'):
+            saida.descarregar()
+        return saida
+    if len(resultados):
+        with etapa('saida'):
+            return resultados.resultado()
     else:
-        print("Nenhum resultado para concatenar.")
+        logger.info("Nenhum resultado para concatenar.")
         return pd.DataFrame()  # Retorna DataFrame vazio
 
 
+# função auxiliar da setor_bairro_correcao
+# primeiro polígono encontrado para cada ponto (equivalente ao iloc[0] do sjoin por linha)
+def _poligono_por_ponto(pontos, poligonos, nome_coluna, predicado):
+    intersecao = gpd.sjoin(pontos, poligonos[[nome_coluna, 'geometry']], how='inner', predicate=predicado)
+    intersecao = intersecao.rename_axis('_linha').sort_values(['_linha', 'index_right'])
+    intersecao = intersecao[~intersecao.index.duplicated(keep='first')]
+    return intersecao[nome_coluna]
+
+
+# Camadas usadas pela setor_bairro_correcao: setores, bairros, índice de logradouros e polígonos por logradouro
+# para chamadas repetidas com as mesmas camadas (lotes lidos do banco), prepare uma vez e passe em camadas=
+def camadas_setor_bairro(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, coluna_codlog_eixos='codlog', encoding_eixos=None, comprimento_minimo=0.0):
+    # shapes, todos em UTM (EPSG:31984)
+    with etapa('carregar_camadas'):
+        setores = carregar_camada(caminho_arquivo_setor)
+        bairros = carregar_camada(caminho_arquivo_bairro)
+    with etapa('indice_logradouros'):
+        indice = carregar_indice_logradouros(caminho_arquivo_log, coluna_codlog_eixos, encoding=encoding_eixos)
+    # setores e bairros de cada logradouro pelas tabelas de sobreposição
+    with etapa('sobreposicao'):
+        setores_por_logradouro = carregar_poligonos_por_logradouro(
+            caminho_arquivo_log, coluna_codlog_eixos, caminho_arquivo_setor, 'Name', encoding_eixos, comprimento_minimo)
+        bairros_por_logradouro = carregar_poligonos_por_logradouro(
+            caminho_arquivo_log, coluna_codlog_eixos, caminho_arquivo_bairro, 'Bairro', encoding_eixos, comprimento_minimo)
+    return {'setores': setores, 'bairros': bairros, 'indice': indice,
+            'setores_por_logradouro': setores_por_logradouro, 'bairros_por_logradouro': bairros_por_logradouro}
+
+
+# correção de setor fiscal e bairro numa única passada
+# o ponto do imóvel é calculado uma vez (coordenada sedur ou logradouro + nº de porta) e cruzado com setores e bairros em sjoin únicos
+# com saida (ColetorResultados) as linhas sinalizadas vão para o coletor, que é devolvido
+# camadas (camadas_setor_bairro) evita preparar as camadas de novo a cada chamada
+# analise_manual é 'sim' nos mesmos casos da setor_fiscal_correto e da bairro_correcao, sem o detalhe entre parênteses
+def setor_bairro_correcao(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, nome_coluna_bairro, df, coluna_codlog_eixos='codlog', encoding_eixos=None, comprimento_minimo=0.0, saida=None,
+                          extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False, camadas=None):
+    if camadas is None:
+        camadas = camadas_setor_bairro(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro,
+                                       coluna_codlog_eixos, encoding_eixos, comprimento_minimo)
+
+    entrada = df.reset_index(drop=True)
+    codlogs = entrada[nome_coluna_log]
+
+    numeros = pd.to_numeric(entrada[nome_coluna_nporta], errors='coerce')
+
+    # localizando logradouros e interpolando os números de porta pelo índice de logradouros
+    with etapa('interpolacao'):
+        interpolados = pontos_numero_porta(camadas['indice'], codlogs, numeros.fillna(0) / 100000)
+    com_logradouro = interpolados['encontrado']
+    contar('logradouro_nao_encontrado', (~com_logradouro).sum())
+    if not com_logradouro.all():
+        logger.info("%d linhas com logradouro não encontrado no shapefile.", (~com_logradouro).sum())
+
+    # normalizando as coordenadas sedur de uma vez (vírgula decimal, eixos trocados, graus, fora da extensão)
+    coordenadas = normalizar_coordenadas(entrada, coord_x, coord_y, extensao, corrigir_coordenadas)
+    tem_coord = coordenadas['situacao'] != 'ausente'
+    x_sedur, y_sedur = coordenadas['x'], coordenadas['y']
+    coord_invalida = com_logradouro & tem_coord & ~coordenadas['valida']
+    if coord_invalida.any():
+        logger.warning("%d linhas com coordenadas inválidas.", coord_invalida.sum())
+
+    # origem do ponto de cada imóvel
+    por_coordenada = com_logradouro & tem_coord & ~coord_invalida
+    por_numero = com_logradouro & ~tem_coord & numeros.notna() & (numeros != 0)
+    alem_do_fim = por_numero & interpolados['alem_do_fim']
+    contar('alem_do_fim', alem_do_fim.sum())
+    if alem_do_fim.any():
+        logger.info("%d números de porta maiores que o comprimento do logradouro.", alem_do_fim.sum())
+    por_numero = por_numero & ~alem_do_fim
+    por_logradouro = com_logradouro & ~tem_coord & (numeros == 0)
+
+    x = x_sedur.where(por_coordenada)
+    y = y_sedur.where(por_coordenada)
+    x[por_numero] = interpolados['x'][por_numero]
+    y[por_numero] = interpolados['y'][por_numero]
+
+    com_ponto = por_coordenada | por_numero
+    pontos = gpd.GeoDataFrame(
+        index=entrada.index[com_ponto],
+        geometry=gpd.points_from_xy(x[com_ponto], y[com_ponto]), crs='EPSG:31984')
+
+    # um sjoin em lote por camada para todos os pontos
+    with etapa('sjoin'):
+        setor_encontrado = _poligono_por_ponto(pontos, camadas['setores'], 'Name', 'within').reindex(entrada.index)
+        bairro_encontrado = _poligono_por_ponto(pontos, camadas['bairros'], 'Bairro', 'intersects').reindex(entrada.index)
+
+    # endereços sem nº de porta: setores e bairros de cada logradouro pelas tabelas de sobreposição
+    with etapa('sobreposicao'):
+        setores_logradouro = codlogs.map(camadas['setores_por_logradouro'])
+        bairros_logradouro = codlogs.map(camadas['bairros_por_logradouro'])
+
+    qtd_setores = setores_logradouro.str.len().where(por_logradouro, 0).fillna(0)
+    qtd_bairros = bairros_logradouro.str.len().where(por_logradouro, 0).fillna(0)
+    setor_multiplo = qtd_setores > 1
+    bairro_multiplo = qtd_bairros > 1
+    setor_encontrado = setor_encontrado.mask(qtd_setores == 1, setores_logradouro.str[0])
+    bairro_encontrado = bairro_encontrado.mask(qtd_bairros == 1, bairros_logradouro.str[0])
+
+    setor_mudou = setor_encontrado.notna() & (setor_encontrado != entrada[nome_coluna_sfiscal])
+    bairro_mudou = bairro_encontrado.notna() & (bairro_encontrado != entrada[nome_coluna_bairro])
+
+    # montando as colunas de saída
+    origens = [por_coordenada, por_numero, por_logradouro]
+    parametro = np.select(origens, [
+        'coordenada sedur',
+        'localização pelo logradouro e nº de porta',
+        'interseção logradouro x setor fiscal/bairro'], default='')
+    conclusao_setor = np.select(
+        [setor_multiplo] + [setor_mudou & origem for origem in origens], [
+            'logradouro com mais de 1 setor fiscal. endereço sem nº de porta',
+            'setor fiscal pela coordenada',
+            'setor fiscal pelo endereço do imóvel',
+            'logradouro pertencente a apenas 1 setor fiscal. endereço sem nº de porta'], default='')
+    conclusao_bairro = np.select(
+        [bairro_multiplo] + [bairro_mudou & origem for origem in origens], [
+            'logradouro com mais de 1 bairro. endereço sem nº de porta',
+            'bairro pela coordenada',
+            'bairro pelo endereço do imóvel',
+            'logradouro pertencente a apenas 1 bairro. endereço sem nº de porta'], default='')
+    separador = np.where((conclusao_setor != '') & (conclusao_bairro != ''), '; ', '')
+
+    resultado = entrada.copy()
+    resultado['setor_fiscal_novo'] = setor_encontrado.where(setor_mudou, '')
+    resultado['bairro_novo'] = bairro_encontrado.where(bairro_mudou, '')
+    resultado['parametro'] = parametro
+    resultado['conclusão'] = np.char.add(np.char.add(conclusao_setor, separador), conclusao_bairro)
+    # mesmos casos de análise manual das validações separadas: logradouro sem nº de porta com mais de 1 setor/bairro,
+    # setor alterado pelo nº de porta (setor_fiscal_correto) e bairro alterado pela coordenada (bairro_correcao)
+    resultado['analise_manual'] = np.where(
+        setor_multiplo | bairro_multiplo | (por_numero & setor_mudou) | (por_coordenada & bairro_mudou), 'sim', 'nao')
+
+    sinalizados = setor_mudou | bairro_mudou | setor_multiplo | bairro_multiplo
+    contar('setor_alterado', setor_mudou.sum())
+    contar('bairro_alterado', bairro_mudou.sum())
+    contar('analise_manual', (resultado['analise_manual'] == 'sim').sum())
+    if not sinalizados.any():
+        logger.info("Nenhum resultado para concatenar.")
+    if saida is not None:
+        with etapa('saida'):
+            saida.adicionar_df(resultado[sinalizados])
+        return saida
+    return resultado[sinalizados].reset_index(drop=True)
+
+
+# Cadastros enriquecidos de uma ficha; conn pode ser uma conexão ou um pool de conexões (criar_pool)
 def dados_inscricoes_banco_enriquecimento(conn, ficha):
     try:
         query = """
@@ -450,10 +760,246 @@ def dados_inscricoes_banco_enriquecimento(conn, ficha):
             order by e.ide_cadastro asc
         """
 
-        with conn.cursor() as cur:
+        with obter_conexao(conn) as conexao, conexao.cursor() as cur:
             cur.execute(query, (ficha,))  # ficha é passado como tupla
             cadastros = cur.fetchall()
             return cadastros
     except Exception as e:
-        print(f"Erro ao obter cadastros: {e}")
+        logger.exception("Erro ao obter cadastros da ficha %s: %s", ficha, e)
+        contar('erros')
         return []
+
+
+# colunas da salvador.enriquecimentos para os parâmetros das validações (setor_bairro_correcao, bairro_correcao, setor_fiscal_correto)
+# o setor fiscal não está na tabela: informe a coluna em colunas_extras e em nome_coluna_sfiscal
+PARAMETROS_ENRIQUECIMENTO = {
+    'nome_coluna_log': 'cod_log_destinatario_enriquecido',
+    'nome_coluna_nporta': 'num_imovel_destinatario_enriquecido',
+    'coord_x': 'coordenada_geo_x_enriquecido',
+    'coord_y': 'coordenada_geo_y_enriquecido',
+    'nome_coluna_bairro': 'nom_bairro_destinatario_enriquecido',
+}
+
+# quantidade padrão de linhas trazidas do servidor por vez na leitura em lotes
+ITERSIZE_ENRIQUECIMENTO = 50000
+
+# oid do tipo numeric do PostgreSQL (cursor.description)
+OID_NUMERIC = 1700
+
+
+# Cadastros enriquecidos de uma ou mais fichas em lotes (DataFrames de até itersize linhas)
+# usa um cursor nomeado (do lado do servidor): só um lote fica na memória por vez, qualquer que seja o tamanho da ficha
+# ide_cadastro vem como inteiro, colunas numeric e as coordenadas como float (vírgula decimal aceita); as demais como o banco devolve
+def dados_inscricoes_banco_enriquecimento_lotes(conn, fichas, itersize=ITERSIZE_ENRIQUECIMENTO, colunas_extras=()):
+    if isinstance(fichas, (str, int)):
+        fichas = [fichas]
+    colunas = ['ficha', 'ide_cadastro', 'cod_log_destinatario_enriquecido', 'nom_logradouro_match',
+               'num_imovel_destinatario_enriquecido', 'nom_bairro_destinatario_enriquecido',
+               'coordenada_geo_x_enriquecido', 'coordenada_geo_y_enriquecido']
+    colunas += [coluna for coluna in colunas_extras if coluna not in colunas]
+    query = sql.SQL("""
+        select {colunas}
+        from salvador.enriquecimentos e
+        where e.ficha = any(%s)
+        order by e.ficha, e.ide_cadastro asc
+    """).format(colunas=sql.SQL(', ').join(sql.Identifier('e', coluna) for coluna in colunas))
+
+    try:
+        with obter_conexao(conn) as conexao:
+            # em autocommit o cursor nomeado precisa de withhold para sobreviver fora de uma transação
+            with conexao.cursor(name='enriquecimentos_lotes', withhold=conexao.autocommit) as cur:
+                cur.itersize = itersize
+                cur.execute(query, (list(fichas),))
+                while True:
+                    with etapa('leitura_banco'):
+                        linhas = cur.fetchmany(itersize)
+                    if not linhas:
+                        break
+                    lote = pd.DataFrame.from_records(linhas, columns=colunas)
+                    # colunas numeric chegam como Decimal; viram float para as operações vetorizadas
+                    for coluna in cur.description:
+                        if coluna.type_code == OID_NUMERIC:
+                            lote[coluna.name] = pd.to_numeric(lote[coluna.name], errors='coerce')
+                    lote['ide_cadastro'] = pd.to_numeric(lote['ide_cadastro'])
+                    for coluna in ('coordenada_geo_x_enriquecido', 'coordenada_geo_y_enriquecido'):
+                        lote[coluna] = pd.to_numeric(
+                            lote[coluna].astype(str).str.replace(',', '.'), errors='coerce')
+                    yield lote
+    except Exception as e:
+        # interrompe em vez de devolver lotes incompletos
+        logger.error("Erro ao obter cadastros das fichas %s: %s", list(fichas), e)
+        contar('erros')
+        raise
+
+
+# Correção de setor fiscal e bairro dos cadastros enriquecidos, lote a lote
+# cada lote lido do banco passa pela setor_bairro_correcao; devolve um DataFrame de linhas sinalizadas por lote
+# camadas, índice de logradouros e polígonos por logradouro são preparados uma vez, antes do primeiro lote
+def setor_bairro_correcao_enriquecimento(conn, fichas, caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro,
+                                         nome_coluna_sfiscal, itersize=ITERSIZE_ENRIQUECIMENTO, **parametros):
+    if parametros.get('camadas') is None:
+        parametros['camadas'] = camadas_setor_bairro(
+            caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, parametros.get('coluna_codlog_eixos', 'codlog'),
+            parametros.get('encoding_eixos'), parametros.get('comprimento_minimo', 0.0))
+    for lote in dados_inscricoes_banco_enriquecimento_lotes(conn, fichas, itersize, colunas_extras=[nome_coluna_sfiscal]):
+        yield setor_bairro_correcao(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro,
+                                    nome_coluna_sfiscal=nome_coluna_sfiscal, df=lote,
+                                    **{**PARAMETROS_ENRIQUECIMENTO, **parametros})
+
+
+# tabela que recebe as correções validadas (uma linha por ficha, execução, validação e cadastro)
+SQL_TABELA_CORRECOES = """
+    create table if not exists salvador.correcoes_enriquecimento (
+        ficha text not null,
+        execucao text not null,
+        validacao text not null,
+        ide_cadastro bigint not null,
+        setor_fiscal_novo text,
+        bairro_novo text,
+        parametro text,
+        conclusao text,
+        analise_manual text,
+        atualizado_em timestamptz not null default now(),
+        primary key (ficha, execucao, validacao, ide_cadastro)
+    );
+"""
+
+# colunas de correção gravadas (coluna do DataFrame -> coluna da tabela)
+COLUNAS_CORRECOES = {
+    'setor_fiscal_novo': 'setor_fiscal_novo',
+    'bairro_novo': 'bairro_novo',
+    'parametro': 'parametro',
+    'conclusão': 'conclusao',
+    'analise_manual': 'analise_manual',
+}
+
+
+# Cria a tabela de correções (SQL_TABELA_CORRECOES), se ainda não existir
+def criar_tabela_correcoes(conn):
+    with obter_conexao(conn) as conexao, conexao.cursor() as cur:
+        cur.execute(SQL_TABELA_CORRECOES)
+        conexao.commit()
+
+
+# função auxiliar da gravar_correcoes_banco
+# validação de origem pelas colunas do resultado (setor_bairro_correcao, bairro_correcao ou setor_fiscal_correto)
+def _validacao_resultado(colunas):
+    if 'setor_fiscal_novo' in colunas and 'bairro_novo' in colunas:
+        return 'setor_bairro'
+    return 'bairro' if 'bairro_novo' in colunas else 'setor_fiscal'
+
+
+# Grava as correções de uma execução na tabela salvador.correcoes_enriquecimento
+# resultados é um DataFrame (com ide_cadastro e as colunas de correção) ou uma sequência de DataFrames (lotes)
+# os lotes vão para uma tabela temporária com COPY e entram na tabela final num único comando (insert ... on conflict)
+# idempotente por ficha e execução: regravar atualiza só o que mudou e remove as correções que deixaram de aparecer
+# só são substituídas as fichas com linhas em resultados, a ficha informada e as de fichas (todas as fichas validadas,
+# inclusive as que ficaram sem correção); as correções antigas das demais fichas continuam na tabela
+# sem a coluna ficha nos resultados, informe a ficha; sem nenhuma linha, informe a validacao (não dá para deduzir das colunas)
+# retorna as contagens ou None em caso de erro
+def gravar_correcoes_banco(conn, resultados, execucao, ficha=None, validacao=None, criar_tabela=True, fichas=None):
+    if isinstance(resultados, pd.DataFrame):
+        resultados = [resultados]
+    colunas = ['ficha', 'ide_cadastro'] + list(COLUNAS_CORRECOES.values())
+
+    try:
+        with obter_conexao(conn) as conexao, conexao.cursor() as cur:
+            # cópia e merge numa única transação, mesmo em conexão com autocommit (a tabela temporária some no commit)
+            autocommit = conexao.autocommit
+            if autocommit:
+                conexao.autocommit = False
+            try:
+                if criar_tabela:
+                    cur.execute(SQL_TABELA_CORRECOES)
+                cur.execute("""
+                    create temp table correcoes_staging (
+                        ficha text, ide_cadastro bigint, setor_fiscal_novo text, bairro_novo text,
+                        parametro text, conclusao text, analise_manual text
+                    ) on commit drop
+                """)
+
+                # cópia dos lotes para a tabela temporária (\N marca nulo; '' continua texto vazio)
+                fichas = {str(valor) for valor in fichas or ()} | ({str(ficha)} if ficha is not None else set())
+                copiadas = 0
+                for lote in resultados:
+                    if lote is None or lote.empty:
+                        continue
+                    validacao = validacao or _validacao_resultado(lote.columns)
+                    staging = pd.DataFrame({
+                        'ficha': lote['ficha'].astype(str) if ficha is None else str(ficha),
+                        'ide_cadastro': pd.to_numeric(lote['ide_cadastro']).astype('int64'),
+                    })
+                    for coluna, destino in COLUNAS_CORRECOES.items():
+                        staging[destino] = lote[coluna] if coluna in lote.columns else None
+                    fichas.update(staging['ficha'].unique())
+                    buffer = io.StringIO()
+                    staging[colunas].to_csv(buffer, header=False, index=False, na_rep='\\N')
+                    buffer.seek(0)
+                    with etapa('gravacao_banco'):
+                        cur.copy_expert(
+                            f"copy correcoes_staging ({', '.join(colunas)}) from stdin with (format csv, null '\\N')", buffer)
+                    copiadas += len(staging)
+                if validacao is None and fichas:
+                    raise ValueError("nenhuma correção nos resultados: informe a validacao para substituir as fichas")
+                validacao = validacao or 'setor_bairro'
+
+                # um cadastro repetido na mesma execução fica com a última linha copiada
+                inicio_merge = time.perf_counter()
+                cur.execute("""
+                    with staging as (
+                        select distinct on (ficha, ide_cadastro) *
+                        from correcoes_staging
+                        order by ficha, ide_cadastro, ctid desc
+                    ),
+                    removidas as (
+                        delete from salvador.correcoes_enriquecimento c
+                        where c.ficha = any(%(fichas)s) and c.execucao = %(execucao)s and c.validacao = %(validacao)s
+                          and not exists (select 1 from staging s where s.ficha = c.ficha and s.ide_cadastro = c.ide_cadastro)
+                        returning 1
+                    ),
+                    gravadas as (
+                        insert into salvador.correcoes_enriquecimento as c (
+                            ficha, execucao, validacao, ide_cadastro,
+                            setor_fiscal_novo, bairro_novo, parametro, conclusao, analise_manual)
+                        select ficha, %(execucao)s, %(validacao)s, ide_cadastro,
+                               setor_fiscal_novo, bairro_novo, parametro, conclusao, analise_manual
+                        from staging
+                        on conflict (ficha, execucao, validacao, ide_cadastro) do update set
+                            setor_fiscal_novo = excluded.setor_fiscal_novo,
+                            bairro_novo = excluded.bairro_novo,
+                            parametro = excluded.parametro,
+                            conclusao = excluded.conclusao,
+                            analise_manual = excluded.analise_manual,
+                            atualizado_em = now()
+                        where (c.setor_fiscal_novo, c.bairro_novo, c.parametro, c.conclusao, c.analise_manual)
+                              is distinct from
+                              (excluded.setor_fiscal_novo, excluded.bairro_novo, excluded.parametro,
+                               excluded.conclusao, excluded.analise_manual)
+                        returning (xmax = 0) as inserida
+                    )
+                    select (select count(*) from staging),
+                           (select count(*) from removidas),
+                           count(*) filter (where inserida),
+                           count(*) filter (where not inserida)
+                    from gravadas
+                """, {'fichas': sorted(fichas), 'execucao': execucao, 'validacao': validacao})
+                distintas, removidas, inseridas, atualizadas = cur.fetchone()
+                conexao.commit()
+                metricas.registrar_tempo('gravacao_banco', time.perf_counter() - inicio_merge)
+            finally:
+                # desfaz o que ficou pendente depois de um erro antes de devolver o modo original da conexão
+                conexao.rollback()
+                if autocommit:
+                    conexao.autocommit = True
+    except Exception as e:
+        logger.exception("Erro ao gravar correções: %s", e)
+        contar('erros')
+        return None
+
+    contagens = {
+        'copiadas': copiadas, 'inseridas': inseridas, 'atualizadas': atualizadas,
+        'inalteradas': distintas - inseridas - atualizadas, 'removidas': removidas,
+    }
+    logger.info("Correções gravadas (%s, execução %s): %s", validacao, execucao, contagens,
+                extra={'validacao': validacao, 'execucao': execucao, **contagens})
+    return contagens
@@ -0,0 +1,100 @@
+import importlib
+import os
+import subprocess
+import sys
+import types
+
+from functions_log import etapa, obter_logger
+
+
+logger = obter_logger('importacao')
+
+# dependências pesadas, carregadas só quando uma função que as usa é chamada
+MODULOS_PESADOS = ('geopandas', 'shapely', 'osmnx', 'geopy', 'brazilcep', 'requests', 'pyproj', 'pyogrio', 'fiona', 'folium')
+# tempo máximo de importação (segundos, num processo novo) de cada módulo de entrada
+# pandas (~0,5 s) continua sendo importado na carga; o resto do orçamento é folga para máquinas mais lentas
+ORCAMENTO_IMPORTACAO = {
+    'functions_log': 0.1,
+    'functions_cache': 0.1,
+    'functions_verticais': 1.0,
+    'functions_consultas': 1.0,
+    'functions_geodados': 1.2,
+    'functions_paralelo': 1.2,
+}
+
+
+# Módulo carregado no primeiro acesso a um atributo (ex.: gpd = modulo_tardio('geopandas'); gpd.sjoin(...))
+# os atributos usados ficam guardados no próprio proxy; o tempo de carga entra na etapa 'importacao' das métricas
+class ModuloTardio(types.ModuleType):
+    def __init__(self, nome):
+        super().__init__(nome)
+        self._modulo = None
+
+    def _carregar(self):
+        if self._modulo is None:
+            with etapa('importacao'):
+                self._modulo = importlib.import_module(self.__name__)
+            logger.debug("Módulo %s carregado.", self.__name__)
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        if atributo.startswith('__'):
+            raise AttributeError(atributo)
+        valor = getattr(self._carregar(), atributo)
+        setattr(self, atributo, valor)
+        return valor
+
+    def __dir__(self):
+        return dir(self._carregar())
+
+    def __repr__(self):
+        estado = 'carregado' if self._modulo is not None else 'não carregado'
+        return f"<módulo tardio {self.__name__} ({estado})>"
+
+
+# proxies já criados, por nome do módulo
+_modulos_tardios = {}
+
+
+# Proxy de importação tardia do módulo (o mesmo proxy para o mesmo nome)
+def modulo_tardio(nome):
+    if nome not in _modulos_tardios:
+        _modulos_tardios[nome] = ModuloTardio(nome)
+    return _modulos_tardios[nome]
+
+
+# Tempo de importação de um módulo num processo python novo (menor de repeticoes medições)
+# retorna dict com segundos e as dependências pesadas que a importação carregou
+def medir_importacao(modulo, repeticoes=3):
+    codigo = (
+        "import sys, time\n"
+        "inicio = time.perf_counter()\n"
+        f"import {modulo}\n"
+        "print(time.perf_counter() - inicio)\n"
+        f"print(','.join(m for m in {MODULOS_PESADOS!r} if m in sys.modules))\n")
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    ambiente = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [pasta, os.environ.get('PYTHONPATH')])))
+    tempos = []
+    for _ in range(repeticoes):
+        processo = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True, cwd=pasta, env=ambiente)
+        if processo.returncode != 0:
+            raise ImportError(f"Falha ao importar {modulo}: {processo.stderr.strip().splitlines()[-1:]}")
+        segundos, pesados = processo.stdout.splitlines()[-2:]
+        tempos.append(float(segundos))
+    return {'modulo': modulo, 'segundos': round(min(tempos), 3), 'pesados_carregados': [m for m in pesados.split(',') if m]}
+
+
+# Compara o tempo de importação dos módulos de entrada com o orçamento
+# módulos acima do limite ou que carregam dependências pesadas na importação são informados no log (WARNING)
+def verificar_orcamento_importacao(orcamento=None, repeticoes=3):
+    resultados = []
+    for modulo, limite in (orcamento or ORCAMENTO_IMPORTACAO).items():
+        medicao = medir_importacao(modulo, repeticoes)
+        medicao['limite'] = limite
+        medicao['dentro_do_orcamento'] = medicao['segundos'] <= limite and not medicao['pesados_carregados']
+        if not medicao['dentro_do_orcamento']:
+            logger.warning("Importação de %s: %.3f s (limite %.3f s), dependências pesadas carregadas: %s",
+                           modulo, medicao['segundos'], limite, medicao['pesados_carregados'] or 'nenhuma',
+                           extra=medicao)
+        resultados.append(medicao)
+    return resultados
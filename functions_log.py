@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# nome do logger das funções de validação (módulos usam subloggers: geodados.verticais, ...)
+NOME_LOGGER = 'geodados'
+# segundos entre duas mensagens de progresso
+INTERVALO_PROGRESSO = 10.0
+# atributos padrão de um LogRecord; os demais (passados em extra=) entram como campos no log json
+_CAMPOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+# Formatador de log estruturado: uma linha json por mensagem, com os campos passados em extra=
+class FormatadorJSON(logging.Formatter):
+    def format(self, registro):
+        dados = {
+            'momento': self.formatTime(registro, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': registro.levelname,
+            'logger': registro.name,
+            'mensagem': registro.getMessage(),
+        }
+        dados.update({campo: valor for campo, valor in vars(registro).items() if campo not in _CAMPOS_PADRAO})
+        if registro.exc_info:
+            dados['excecao'] = self.formatException(registro.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+# Logger do módulo informado (ex.: obter_logger('verticais') -> geodados.verticais)
+def obter_logger(nome=None):
+    return logging.getLogger(f"{NOME_LOGGER}.{nome}" if nome else NOME_LOGGER)
+
+
+# Configura o log das funções de validação
+# nivel e formato ('texto' ou 'json') vêm dos parâmetros ou das variáveis de ambiente GEODADOS_LOG e GEODADOS_LOG_FORMATO
+# sem arquivo as mensagens vão para a saída padrão; mensagens por linha do cadastro ficam no nível DEBUG
+# chamada pelos pontos de entrada (benchmark_geodados, functions_servico); os handlers anteriores do logger são trocados
+def configurar_log(nivel=None, formato=None, arquivo=None):
+    nivel = nivel or os.environ.get('GEODADOS_LOG', 'INFO')
+    formato = formato or os.environ.get('GEODADOS_LOG_FORMATO', 'texto')
+    logger = obter_logger()
+    for anterior in list(logger.handlers):
+        logger.removeHandler(anterior)
+        anterior.close()
+    destino = logging.FileHandler(arquivo, encoding='utf-8') if arquivo else logging.StreamHandler(sys.stdout)
+    if formato == 'json':
+        destino.setFormatter(FormatadorJSON())
+    else:
+        destino.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S'))
+    logger.addHandler(destino)
+    logger.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+    logger.propagate = False
+    return logger
+
+
+# Contadores por resultado e tempos acumulados por etapa de uma execução
+# etapas: carregar_camadas, reprojecao, indice_logradouros, sobreposicao, busca_logradouro, interpolacao, sjoin, saida
+class Metricas:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.reiniciar()
+
+    # Zera contadores e tempos (início de uma nova execução)
+    def reiniciar(self):
+        with self._trava:
+            self.contadores = {}
+            self.tempos = {}
+            self.chamadas = {}
+            self.inicio = time.time()
+
+    # Soma quantidade ao contador do evento (logradouro_nao_encontrado, alem_do_fim, setor_alterado, ...)
+    def contar(self, evento, quantidade=1):
+        with self._trava:
+            self.contadores[evento] = self.contadores.get(evento, 0) + int(quantidade)
+
+    def registrar_tempo(self, nome, segundos, chamadas=1):
+        with self._trava:
+            self.tempos[nome] = self.tempos.get(nome, 0.0) + segundos
+            self.chamadas[nome] = self.chamadas.get(nome, 0) + chamadas
+
+    # Mede o tempo do bloco e soma à etapa
+    @contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_tempo(nome, time.perf_counter() - inicio)
+
+    # Soma o resumo de outra execução (ex.: de um processo filho) a estas métricas
+    def incorporar(self, resumo):
+        for evento, quantidade in resumo['contadores'].items():
+            self.contar(evento, quantidade)
+        for nome, tempo in resumo['etapas'].items():
+            self.registrar_tempo(nome, tempo['segundos'], tempo['chamadas'])
+
+    # Resumo da execução: contadores e, por etapa, segundos acumulados e número de chamadas
+    def resumo(self):
+        with self._trava:
+            return {
+                'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+                'duracao_segundos': round(time.time() - self.inicio, 3),
+                'contadores': dict(sorted(self.contadores.items())),
+                'etapas': {nome: {'segundos': round(self.tempos[nome], 6), 'chamadas': self.chamadas[nome]}
+                           for nome in sorted(self.tempos, key=self.tempos.get, reverse=True)},
+            }
+
+    # Grava o resumo em json
+    def exportar_json(self, caminho):
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+            json.dump(self.resumo(), arquivo, indent=2, ensure_ascii=False)
+        os.replace(caminho + '.tmp', caminho)
+
+
+# métricas do processo (as funções de validação somam aqui)
+metricas = Metricas()
+contar = metricas.contar
+etapa = metricas.etapa
+
+
+# função auxiliar da Progresso
+def _formatar_duracao(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+# Progresso de um laço sobre as linhas do cadastro, com taxa e tempo restante estimado (ETA)
+# informa no máximo uma vez a cada intervalo segundos, no nível INFO
+class Progresso:
+    def __init__(self, total, descricao, intervalo=INTERVALO_PROGRESSO, logger=None):
+        self.total = total
+        self.descricao = descricao
+        self.intervalo = intervalo
+        self.logger = logger or obter_logger()
+        self.feitas = 0
+        self.inicio = self.ultimo = time.monotonic()
+
+    def avancar(self, quantidade=1):
+        self.feitas += quantidade
+        agora = time.monotonic()
+        if agora - self.ultimo >= self.intervalo:
+            self.ultimo = agora
+            decorrido = agora - self.inicio
+            taxa = self.feitas / decorrido if decorrido else 0.0
+            restante = (self.total - self.feitas) / taxa if taxa else 0.0
+            self.logger.info(
+                "%s: %d/%d linhas (%.1f%%), %.0f linhas/s, ETA %s",
+                self.descricao, self.feitas, self.total, 100 * self.feitas / max(self.total, 1), taxa,
+                _formatar_duracao(restante),
+                extra={'etapa': self.descricao, 'feitas': self.feitas, 'total': self.total,
+                       'linhas_por_segundo': round(taxa, 1), 'eta_segundos': round(restante, 1)})
+
+    def concluir(self):
+        if not self.feitas:
+            return
+        decorrido = time.monotonic() - self.inicio
+        self.logger.info(
+            "%s: %d linhas em %s", self.descricao, self.feitas, _formatar_duracao(decorrido),
+            extra={'etapa': self.descricao, 'feitas': self.feitas, 'segundos': round(decorrido, 3)})
+
+
+# a importação não mexe no log da aplicação: as mensagens seguem para os handlers dela (propagação)
+# e, sem nenhum configurado, não aparecem; scripts e notebooks chamam configurar_log() para exibi-las
+obter_logger().addHandler(logging.NullHandler())
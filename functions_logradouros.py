@@ -0,0 +1,214 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from functions_cache import carregar_camada, diretorio_cache, versao_camada
+from functions_importacao import modulo_tardio
+
+
+gpd = modulo_tardio('geopandas')
+shapely = modulo_tardio('shapely')
+
+
+# distância máxima (em metros) para considerar dois trechos do mesmo logradouro conectados
+TOLERANCIA_CONEXAO = 0.01
+
+
+# índices de logradouros e polígonos por logradouro já montados neste processo (origem -> (versão das camadas, estrutura))
+# só a última versão de cada origem fica guardada; com fork, os processos filhos herdam o que o principal já montou
+_indices_carregados = {}
+_poligonos_carregados = {}
+
+
+# função auxiliar da construir_indice_logradouros
+# encadeia os trechos de um logradouro numa única sequência de vértices, mantendo o sentido do primeiro trecho
+# trechos que não se tocam são ligados por um salto que não conta no comprimento
+def _encadear_trechos(trechos):
+    cadeia = [trechos[0]]
+    inicio, fim = trechos[0][0], trechos[0][-1]
+    saltos_inicio, saltos_fim = [], []
+    restantes = list(trechos[1:])
+
+    while restantes:
+        # trecho mais próximo de uma das pontas da cadeia
+        melhor = None
+        for i, trecho in enumerate(restantes):
+            opcoes = [
+                (np.hypot(*(trecho[0] - fim)), 'fim', False),
+                (np.hypot(*(trecho[-1] - fim)), 'fim', True),
+                (np.hypot(*(trecho[-1] - inicio)), 'inicio', False),
+                (np.hypot(*(trecho[0] - inicio)), 'inicio', True),
+            ]
+            distancia, ponta, inverter = min(opcoes, key=lambda opcao: opcao[0])
+            if melhor is None or distancia < melhor[0]:
+                melhor = (distancia, ponta, inverter, i)
+
+        distancia, ponta, inverter, i = melhor
+        trecho = restantes.pop(i)
+        if inverter:
+            trecho = trecho[::-1]
+        salto = distancia > TOLERANCIA_CONEXAO
+        if ponta == 'fim':
+            saltos_fim.append(salto)
+            cadeia.append(trecho if salto else trecho[1:])
+            fim = trecho[-1]
+        else:
+            saltos_inicio.append(salto)
+            cadeia.insert(0, trecho if salto else trecho[:-1])
+            inicio = trecho[0]
+
+    coords = np.concatenate(cadeia)
+    # comprimento de cada segmento entre vértices, zerando os saltos entre trechos desconectados
+    segmentos = np.hypot(*np.diff(coords, axis=0).T)
+    juncoes = np.cumsum([len(parte) for parte in cadeia])[:-1]
+    saltos = saltos_inicio[::-1] + saltos_fim
+    for juncao, salto in zip(juncoes, saltos):
+        if salto:
+            segmentos[juncao - 1] = 0.0
+    comprimentos = np.concatenate([[0.0], np.cumsum(segmentos)])
+    return coords, comprimentos
+
+
+# Índice de logradouros por codlog
+# cada codlog aponta para a linha encadeada dos seus trechos, com o comprimento acumulado em cada vértice
+# eixos deve estar em UTM (EPSG:31984) para que os comprimentos fiquem em metros
+def construir_indice_logradouros(eixos, coluna_codlog):
+    indice = {}
+    geometrias = eixos.geometry.values
+    for codlog, posicoes in eixos.groupby(coluna_codlog, sort=False).indices.items():
+        partes = shapely.get_parts(geometrias[posicoes])
+        partes = partes[~shapely.is_empty(partes)]
+        trechos = [shapely.get_coordinates(parte) for parte in partes]
+        trechos = [trecho for trecho in trechos if len(trecho) >= 2]
+        if not trechos:
+            continue
+        coords, comprimentos = _encadear_trechos(trechos)
+        indice[codlog] = {
+            'coords': coords,
+            'comprimentos': comprimentos,
+            'comprimento': comprimentos[-1],
+            'posicoes': posicoes,
+        }
+    return indice
+
+
+# função auxiliar da ponto_numero_porta e pontos_numero_porta
+# localiza distâncias ao longo da linha por busca binária nos comprimentos acumulados
+def _interpolar(registro, distancias):
+    coords, comprimentos = registro['coords'], registro['comprimentos']
+    distancias = np.asarray(distancias, dtype=float)
+    alem_do_fim = distancias > registro['comprimento']
+    distancias = np.clip(distancias, 0.0, registro['comprimento'])
+
+    i = np.clip(np.searchsorted(comprimentos, distancias, side='right'), 1, len(comprimentos) - 1)
+    segmento = comprimentos[i] - comprimentos[i - 1]
+    fracao = np.divide(distancias - comprimentos[i - 1], segmento,
+                       out=np.zeros_like(distancias), where=segmento > 0)
+    pontos = coords[i - 1] + fracao[:, None] * (coords[i] - coords[i - 1])
+    return pontos[:, 0], pontos[:, 1], alem_do_fim
+
+
+# Índice de logradouros de um arquivo de eixos (construir_indice_logradouros), montado uma vez por versão da camada
+# encoding e renomear são os da carregar_camada; o índice devolvido é compartilhado e não deve ser alterado
+def carregar_indice_logradouros(caminho_arquivo_log, coluna_codlog, encoding=None, renomear=None):
+    origem = (os.path.abspath(caminho_arquivo_log), str(coluna_codlog), str(encoding), str(sorted((renomear or {}).items())))
+    versao = versao_camada(caminho_arquivo_log)
+    carregado = _indices_carregados.get(origem)
+    if carregado is None or carregado[0] != versao:
+        eixos = carregar_camada(caminho_arquivo_log, encoding=encoding, renomear=renomear)
+        _indices_carregados[origem] = (versao, construir_indice_logradouros(eixos, coluna_codlog))
+    return _indices_carregados[origem][1]
+
+
+# Ponto do número de porta a partir do índice de logradouros
+# retorna (x, y, alem_do_fim) ou None se o codlog não estiver no índice
+# alem_do_fim indica distância maior que o comprimento do logradouro (o ponto fica no fim da linha)
+def ponto_numero_porta(indice, codlog, distancia):
+    registro = indice.get(codlog)
+    if registro is None:
+        return None
+    x, y, alem_do_fim = _interpolar(registro, [distancia])
+    return float(x[0]), float(y[0]), bool(alem_do_fim[0])
+
+
+# Pontos de vários números de porta de uma vez (agrupados por codlog)
+# retorna DataFrame com o índice de codlogs e as colunas x, y, encontrado e alem_do_fim
+def pontos_numero_porta(indice, codlogs, distancias):
+    codlogs = pd.Series(codlogs)
+    distancias = np.asarray(distancias, dtype=float)
+    x = np.full(len(codlogs), np.nan)
+    y = np.full(len(codlogs), np.nan)
+    encontrado = np.zeros(len(codlogs), dtype=bool)
+    alem_do_fim = np.zeros(len(codlogs), dtype=bool)
+
+    posicoes_por_codlog = pd.Series(np.arange(len(codlogs))).groupby(codlogs.to_numpy(), sort=False).indices
+    for codlog, posicoes in posicoes_por_codlog.items():
+        registro = indice.get(codlog)
+        if registro is None:
+            continue
+        x[posicoes], y[posicoes], alem_do_fim[posicoes] = _interpolar(registro, distancias[posicoes])
+        encontrado[posicoes] = True
+
+    return pd.DataFrame({'x': x, 'y': y, 'encontrado': encontrado, 'alem_do_fim': alem_do_fim},
+                        index=codlogs.index)
+
+
+# Tabela de sobreposição logradouro x polígonos (setores fiscais ou bairros)
+# uma linha por codlog e polígono cruzado, com o comprimento do logradouro dentro do polígono e a fração do total
+# eixos e polígonos devem estar em UTM (EPSG:31984)
+def construir_tabela_sobreposicao(eixos, coluna_codlog, poligonos, nome_coluna):
+    trechos = eixos[[coluna_codlog, 'geometry']].rename(columns={coluna_codlog: 'codlog'})
+    areas = poligonos[[nome_coluna, 'geometry']].rename(columns={nome_coluna: 'poligono'})
+    juncao = gpd.sjoin(trechos, areas, how='inner', predicate='intersects')
+
+    # comprimento de cada trecho dentro de cada polígono
+    geometrias_poligonos = areas.geometry.values[areas.index.get_indexer(juncao['index_right'])]
+    juncao['comprimento'] = shapely.length(shapely.intersection(juncao.geometry.values, geometrias_poligonos))
+
+    tabela = juncao.groupby(['codlog', 'poligono'], sort=False)['comprimento'].sum().reset_index()
+    tabela['fracao'] = tabela['comprimento'] / tabela.groupby('codlog')['comprimento'].transform('sum')
+    return tabela.sort_values(['codlog', 'comprimento'], ascending=[True, False], ignore_index=True)
+
+
+# Tabela de sobreposição a partir dos arquivos, construída uma vez por versão das camadas
+# o resultado fica salvo em parquet no diretório de cache e é reaproveitado enquanto os arquivos não mudarem
+def carregar_tabela_sobreposicao(caminho_arquivo_log, coluna_codlog, caminho_arquivo_poligonos, nome_coluna, encoding_eixos=None):
+    chave = hashlib.sha1('|'.join([
+        versao_camada(caminho_arquivo_log), versao_camada(caminho_arquivo_poligonos),
+        str(coluna_codlog), str(nome_coluna), str(encoding_eixos)]).encode('utf-8')).hexdigest()
+    caminho_tabela = os.path.join(diretorio_cache(), f"sobreposicao_{chave}.parquet")
+    if os.path.exists(caminho_tabela):
+        return pd.read_parquet(caminho_tabela)
+
+    eixos = carregar_camada(caminho_arquivo_log, encoding=encoding_eixos)
+    poligonos = carregar_camada(caminho_arquivo_poligonos)
+    tabela = construir_tabela_sobreposicao(eixos, coluna_codlog, poligonos, nome_coluna)
+    tabela.to_parquet(caminho_tabela + '.tmp', index=False)
+    os.replace(caminho_tabela + '.tmp', caminho_tabela)
+    return tabela
+
+
+# Polígonos de cada logradouro a partir da tabela de sobreposição
+# retorna dict codlog -> tupla de polígonos, do maior para o menor comprimento
+# polígonos que o logradouro só toca por até comprimento_minimo metros são ignorados (o maior é sempre mantido)
+def poligonos_por_logradouro(tabela, comprimento_minimo=0.0):
+    maior = ~tabela['codlog'].duplicated(keep='first')
+    considerados = tabela[maior | (tabela['comprimento'] > comprimento_minimo)]
+    return {
+        codlog: tuple(grupo)
+        for codlog, grupo in considerados.groupby('codlog', sort=False)['poligono']}
+
+
+# Polígonos de cada logradouro (poligonos_por_logradouro da tabela de sobreposição), montados uma vez por versão das camadas
+# o dict devolvido é compartilhado e não deve ser alterado
+def carregar_poligonos_por_logradouro(caminho_arquivo_log, coluna_codlog, caminho_arquivo_poligonos, nome_coluna, encoding_eixos=None, comprimento_minimo=0.0):
+    origem = (os.path.abspath(caminho_arquivo_log), str(coluna_codlog), os.path.abspath(caminho_arquivo_poligonos),
+              str(nome_coluna), str(encoding_eixos), float(comprimento_minimo))
+    versao = (versao_camada(caminho_arquivo_log), versao_camada(caminho_arquivo_poligonos))
+    carregado = _poligonos_carregados.get(origem)
+    if carregado is None or carregado[0] != versao:
+        tabela = carregar_tabela_sobreposicao(caminho_arquivo_log, coluna_codlog, caminho_arquivo_poligonos, nome_coluna, encoding_eixos)
+        _poligonos_carregados[origem] = (versao, poligonos_por_logradouro(tabela, comprimento_minimo))
+    return _poligonos_carregados[origem][1]
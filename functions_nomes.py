@@ -0,0 +1,139 @@
+import re
+import unicodedata
+from collections import Counter
+
+import pandas as pd
+
+
+# abreviações comuns em nomes de logradouros (já sem acentos e em minúsculas)
+ABREVIACOES = {
+    'av': 'avenida', 'avd': 'avenida', 'r': 'rua', 'tv': 'travessa', 'trav': 'travessa',
+    'pc': 'praca', 'pca': 'praca', 'pr': 'praca', 'al': 'alameda', 'estr': 'estrada', 'est': 'estrada',
+    'lad': 'ladeira', 'lgo': 'largo', 'lg': 'largo', 'rod': 'rodovia', 'vl': 'vila', 'cj': 'conjunto',
+    'cond': 'condominio', 'lot': 'loteamento', 'bc': 'beco', 'vd': 'viaduto',
+    'dr': 'doutor', 'dra': 'doutora', 'prof': 'professor', 'profa': 'professora', 'eng': 'engenheiro',
+    'gen': 'general', 'gal': 'general', 'cel': 'coronel', 'cap': 'capitao', 'ten': 'tenente', 'tte': 'tenente',
+    'mal': 'marechal', 'alm': 'almirante', 'pres': 'presidente', 'gov': 'governador', 'sen': 'senador',
+    'dep': 'deputado', 'ver': 'vereador', 'des': 'desembargador', 'min': 'ministro', 'visc': 'visconde',
+    'pe': 'padre', 'fr': 'frei', 'd': 'dom', 'sta': 'santa', 'sto': 'santo', 's': 'sao',
+    'n': 'nossa', 'sra': 'senhora', 'nsa': 'nossa senhora', 'ns': 'nossa senhora',
+}
+
+# abreviações que também são palavras comuns ('Pé de Serra', 'Ver o Peso', 'Rua Gal Costa'): só são expandidas com ponto ('Pe. Vieira')
+# o mesmo vale para todas as de uma letra ('Rua D', 'Rua N 2')
+ABREVIACOES_COM_PONTO = {'pe', 'ver', 'des', 'min', 'sen', 'est', 'cap', 'gen', 'gal', 'mal', 'pr'}
+
+# versão das regras de normalização (entra na chave dos índices guardados em cache)
+VERSAO_NORMALIZACAO = 3
+
+# nomes e a normalização esperada, conferidos pela verificar_normalizacao
+EXEMPLOS_NORMALIZACAO = {
+    'Av. Sete de Setembro': 'avenida sete de setembro',
+    'AVENIDA SETE DE SETEMBRO': 'avenida sete de setembro',
+    'R. A': 'rua a',
+    'Rua D': 'rua d',
+    'Pe. Antônio Vieira': 'padre antonio vieira',
+    'Pé de Serra': 'pe de serra',
+    'Rua Pé de Serra': 'rua pe de serra',
+    'Ver o Peso': 'ver o peso',
+    'Ver. João Silva': 'vereador joao silva',
+    'Est. Velha do Aeroporto': 'estrada velha do aeroporto',
+    'Estr Velha do Aeroporto': 'estrada velha do aeroporto',
+    'Rua Gal Costa': 'rua gal costa',
+    'Rua Gen. Labatut': 'rua general labatut',
+    'Trav. Cap. Melo': 'travessa capitao melo',
+    'Ladeira do Mal Cozinhado': 'ladeira do mal cozinhado',
+    'Tv Des. Pedro Ribeiro': 'travessa desembargador pedro ribeiro',
+    'Rua D, Loteamento Jardim': 'rua d loteamento jardim',
+    'Rua N 2': 'rua n 2',
+    'R A': 'r a',
+    'S. Jorge': 'sao jorge',
+    'Praça Pr Lima': 'praca pr lima',
+    'Pr. da Sé': 'praca da se',
+}
+
+# similaridade mínima (trigramas) para aceitar uma correspondência aproximada
+LIMIAR_SIMILARIDADE = 0.6
+
+
+# Nome de logradouro normalizado: sem acentos, minúsculo, sem pontuação e com as abreviações expandidas
+# 'Av. Sete de Setembro' e 'AVENIDA SETE DE SETEMBRO' resultam em 'avenida sete de setembro' (mais exemplos em EXEMPLOS_NORMALIZACAO)
+def normalizar_nome_logradouro(nome):
+    if nome is None or (isinstance(nome, float) and pd.isna(nome)):
+        return ''
+    sem_acentos = unicodedata.normalize('NFKD', str(nome)).encode('ascii', 'ignore').decode('ascii')
+    # cada palavra com a indicação de ponto logo depois dela ('pe.' -> ('pe', '.'))
+    palavras = re.findall(r'([a-z0-9]+)(\.?)', sem_acentos.lower())
+    # abreviações de uma letra e as de ABREVIACOES_COM_PONTO só são expandidas com ponto, em qualquer posição
+    # ('R. A' -> 'rua a', mas 'Rua D' continua 'rua d'; 'Pe. Vieira' -> 'padre vieira', mas 'Pé de Serra' continua 'pe de serra')
+    return ' '.join(
+        ABREVIACOES.get(palavra, palavra) if ponto or (len(palavra) > 1 and palavra not in ABREVIACOES_COM_PONTO)
+        else palavra
+        for palavra, ponto in palavras)
+
+
+# Confere a normalização com os exemplos (EXEMPLOS_NORMALIZACAO por padrão)
+# retorna dict nome -> (obtido, esperado) dos exemplos que divergem; vazio se todos conferem
+def verificar_normalizacao(exemplos=None):
+    divergentes = {}
+    for nome, esperado in (exemplos or EXEMPLOS_NORMALIZACAO).items():
+        obtido = normalizar_nome_logradouro(nome)
+        if obtido != esperado:
+            divergentes[nome] = (obtido, esperado)
+    return divergentes
+
+
+# função auxiliar do índice de nomes
+# trigramas do nome normalizado, com espaços nas pontas para valorizar início e fim das palavras
+def _trigramas(nome):
+    texto = f"  {nome} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+# Índice de nomes de logradouros para busca exata e aproximada
+# aceita nomes simples ou listas de nomes (como o 'name' das arestas do OSM)
+# guarda nome normalizado -> nomes originais e um índice invertido trigrama -> nomes normalizados (com a quantidade de trigramas de cada nome)
+def construir_indice_nomes(nomes):
+    exatos = {}
+    for nome in nomes:
+        for original in (nome if isinstance(nome, (list, tuple, set)) else [nome]):
+            normalizado = normalizar_nome_logradouro(original)
+            if normalizado:
+                exatos.setdefault(normalizado, [])
+                if original not in exatos[normalizado]:
+                    exatos[normalizado].append(original)
+
+    trigramas = {}
+    tamanhos = {}
+    for normalizado in exatos:
+        trigramas_nome = _trigramas(normalizado)
+        tamanhos[normalizado] = len(trigramas_nome)
+        for trigrama in trigramas_nome:
+            trigramas.setdefault(trigrama, []).append(normalizado)
+    return {'exatos': exatos, 'trigramas': trigramas, 'tamanhos': tamanhos}
+
+
+# Busca de um nome no índice de nomes
+# primeiro pelo nome normalizado exato (score 1.0); senão pelo maior índice de Jaccard entre trigramas
+# retorna (nome normalizado, nomes originais, score) ou None abaixo do limiar; empates ficam com o menor nome em ordem alfabética
+def buscar_nome_logradouro(indice, nome, limiar=LIMIAR_SIMILARIDADE):
+    normalizado = normalizar_nome_logradouro(nome)
+    if not normalizado:
+        return None
+    if normalizado in indice['exatos']:
+        return normalizado, indice['exatos'][normalizado], 1.0
+
+    consulta = _trigramas(normalizado)
+    comuns = Counter()
+    for trigrama in consulta:
+        comuns.update(indice['trigramas'].get(trigrama, ()))
+
+    melhor = None
+    for candidato, compartilhados in comuns.items():
+        score = compartilhados / (len(consulta) + indice['tamanhos'][candidato] - compartilhados)
+        if melhor is None or score > melhor[1] or (score == melhor[1] and candidato < melhor[0]):
+            melhor = (candidato, score)
+
+    if melhor is None or melhor[1] < limiar:
+        return None
+    return melhor[0], indice['exatos'][melhor[0]], melhor[1]
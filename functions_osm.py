@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+import pandas as pd
+
+from functions_cache import carregar_camada, diretorio_cache, versao_camada
+from functions_importacao import modulo_tardio
+from functions_nomes import (LIMIAR_SIMILARIDADE, VERSAO_NORMALIZACAO, buscar_nome_logradouro, construir_indice_nomes,
+                             normalizar_nome_logradouro)
+
+
+gpd = modulo_tardio('geopandas')
+ox = modulo_tardio('osmnx')
+
+
+# Grafo OSM de uma cidade inteira (ex.: 'Salvador, Bahia, Brasil')
+# baixado uma única vez e guardado em graphml no diretório de cache
+def grafo_cidade(cidade, network_type='all'):
+    chave = hashlib.sha1(f"{cidade}|{network_type}".encode('utf-8')).hexdigest()[:16]
+    caminho = os.path.join(diretorio_cache(), f"grafo_{chave}.graphml")
+    if os.path.exists(caminho):
+        return ox.load_graphml(caminho)
+    grafo = ox.graph_from_place(cidade, network_type=network_type, simplify=True)
+    ox.save_graphml(grafo, caminho)
+    return grafo
+
+
+# função auxiliar da construir_indice_comprimento_ruas
+# arestas do grafo sem a duplicação ida/volta das vias de mão dupla
+def _arestas_grafo(grafo):
+    if hasattr(ox, 'convert'):
+        grafo = ox.convert.to_undirected(grafo)
+    else:
+        grafo = ox.get_undirected(grafo)
+    return ox.graph_to_gdfs(grafo, nodes=False)
+
+
+# Arestas (GeoDataFrame com name e length) de um extrato OSM local
+# .osm/.xml são lidos pelo osmnx; .pbf exige o pacote pyrosm
+def arestas_extrato(caminho_extrato, network_type='all'):
+    if caminho_extrato.lower().endswith('.pbf'):
+        try:
+            from pyrosm import OSM
+        except ImportError:
+            raise ImportError("A leitura de extratos .pbf requer o pacote pyrosm (pip install pyrosm).")
+        arestas = OSM(caminho_extrato).get_network(network_type=network_type)
+        return arestas[['name', 'length', 'geometry']]
+    return _arestas_grafo(ox.graph_from_xml(caminho_extrato, simplify=True))
+
+
+# Índice de comprimento das ruas de uma cidade
+# soma o length das arestas por nome normalizado; com caminho_bairros também soma por (bairro, nome)
+# retorna DataFrame com bairro ('' para a cidade inteira), nome e comprimento em metros
+def construir_indice_comprimento_ruas(arestas, caminho_bairros=None, coluna_bairro='Bairro'):
+    arestas = arestas[['name', 'length', 'geometry']].explode('name', ignore_index=True)
+    arestas['nome'] = arestas['name'].map(normalizar_nome_logradouro)
+    arestas = arestas[arestas['nome'] != '']
+
+    por_cidade = arestas.groupby('nome', as_index=False)['length'].sum()
+    por_cidade.insert(0, 'bairro', '')
+    tabelas = [por_cidade]
+
+    if caminho_bairros:
+        # cada aresta entra no bairro que contém seu ponto representativo
+        bairros = carregar_camada(caminho_bairros)
+        pontos = gpd.GeoDataFrame(
+            arestas[['nome', 'length']], geometry=arestas.geometry.to_crs(bairros.crs).representative_point())
+        pontos = gpd.sjoin(pontos, bairros[[coluna_bairro, 'geometry']], how='inner', predicate='within')
+        pontos['bairro'] = pontos[coluna_bairro].map(normalizar_nome_logradouro)
+        tabelas.append(pontos.groupby(['bairro', 'nome'], as_index=False)['length'].sum())
+
+    return pd.concat(tabelas, ignore_index=True).rename(columns={'length': 'comprimento'})
+
+
+# Índice de comprimento das ruas a partir de um extrato local ou do grafo da cidade, construído uma vez e guardado em parquet
+# retorna dict com 'comprimentos' ((bairro, nome) -> metros) e 'nomes' (índice de nomes), usado pela comprimento_rua
+def carregar_indice_comprimento_ruas(cidade=None, caminho_extrato=None, caminho_bairros=None, coluna_bairro='Bairro'):
+    if caminho_extrato is None and cidade is None:
+        raise ValueError("Informe a cidade ou o caminho de um extrato OSM.")
+    origem = versao_camada(caminho_extrato) if caminho_extrato else cidade
+    bairros = versao_camada(caminho_bairros) if caminho_bairros else ''
+    chave = hashlib.sha1(
+        f"{origem}|{bairros}|{coluna_bairro}|{VERSAO_NORMALIZACAO}".encode('utf-8')).hexdigest()[:16]
+    caminho_indice = os.path.join(diretorio_cache(), f"comprimento_ruas_{chave}.parquet")
+
+    if os.path.exists(caminho_indice):
+        tabela = pd.read_parquet(caminho_indice)
+    else:
+        arestas = arestas_extrato(caminho_extrato) if caminho_extrato else _arestas_grafo(grafo_cidade(cidade))
+        tabela = construir_indice_comprimento_ruas(arestas, caminho_bairros, coluna_bairro)
+        tabela.to_parquet(caminho_indice + '.tmp', index=False)
+        os.replace(caminho_indice + '.tmp', caminho_indice)
+
+    return {
+        'comprimentos': dict(zip(zip(tabela['bairro'], tabela['nome']), tabela['comprimento'])),
+        'nomes': construir_indice_nomes(tabela.loc[tabela['bairro'] == '', 'nome']),
+    }
+
+
+# Comprimento de uma rua pelo índice da cidade (no bairro informado, se houver, senão na cidade inteira)
+# o nome é procurado no índice de nomes (exato ou aproximado); retorna None se a rua não for encontrada
+def comprimento_rua(indice, nome_rua, bairro=None, limiar=LIMIAR_SIMILARIDADE):
+    correspondencia = buscar_nome_logradouro(indice['nomes'], nome_rua, limiar)
+    if correspondencia is None:
+        return None
+    nome = correspondencia[0]
+    if bairro:
+        comprimento = indice['comprimentos'].get((normalizar_nome_logradouro(bairro), nome))
+        if comprimento is not None:
+            return comprimento
+    return indice['comprimentos'].get(('', nome))
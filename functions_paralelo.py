@@ -0,0 +1,201 @@
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from functions_coordenadas import EXTENSAO_SALVADOR
+from functions_geodados import (bairro_correcao, coordenada_numero_porta, coordenada_numero_porta_lote,
+                                setor_bairro_correcao, setor_fiscal_correto)
+from functions_log import metricas
+
+
+# lado (em metros, UTM) dos quadrados usados na partição espacial
+TAMANHO_TILE = 2000
+# partições por processo: mais de uma equilibra a carga quando alguns logradouros/quadrados têm muito mais imóveis
+PARTICOES_POR_WORKER = 2
+# coluna auxiliar com a posição de cada linha na entrada (usada para devolver os resultados na ordem original)
+COLUNA_ORDEM = '__ordem'
+
+# entrada da execução em andamento; com fork os processos filhos a herdam sem cópia e recebem só as posições
+_entrada_compartilhada = None
+
+
+# quantidade padrão de processos (variável de ambiente GEODADOS_WORKERS ou todos os núcleos)
+def workers_padrao():
+    return int(os.environ.get('GEODADOS_WORKERS') or os.cpu_count() or 1)
+
+
+# função auxiliar das partições
+# distribui grupos de linhas entre n partições, do maior grupo para o menor, sempre na partição com menos linhas
+# retorna listas de posições em ordem crescente (cada partição preserva a ordem da entrada)
+def _distribuir_grupos(chaves, n):
+    grupos = pd.Series(np.arange(len(chaves))).groupby(pd.Series(chaves).to_numpy(), sort=True, dropna=False).indices
+    particoes = [[] for _ in range(n)]
+    cargas = [(0, i) for i in range(n)]
+    for posicoes in sorted(grupos.values(), key=len, reverse=True):
+        carga, i = heapq.heappop(cargas)
+        particoes[i].extend(posicoes)
+        heapq.heappush(cargas, (carga + len(posicoes), i))
+    return [np.sort(np.asarray(posicoes, dtype=int)) for posicoes in particoes if posicoes]
+
+
+# Partições por logradouro: todas as linhas de um codlog ficam na mesma partição
+def particoes_por_codlog(df, nome_coluna_log, n):
+    return _distribuir_grupos(df[nome_coluna_log].astype(str).to_numpy(), n)
+
+
+# Partições espaciais: linhas com coordenada agrupadas por quadrado de tamanho_tile metros
+# linhas sem coordenada válida são agrupadas pelo codlog
+def particoes_por_tile(df, nome_coluna_log, coord_x, coord_y, n, tamanho_tile=TAMANHO_TILE):
+    x = pd.to_numeric(df[coord_x].astype(str).str.replace(',', '.'), errors='coerce').to_numpy()
+    y = pd.to_numeric(df[coord_y].astype(str).str.replace(',', '.'), errors='coerce').to_numpy()
+    com_coord = ~(np.isnan(x) | np.isnan(y))
+    chaves = np.where(
+        com_coord,
+        'tile ' + pd.Series(np.floor(x / tamanho_tile)).astype(str) + ' ' + pd.Series(np.floor(y / tamanho_tile)).astype(str),
+        'codlog ' + df[nome_coluna_log].astype(str).reset_index(drop=True))
+    return _distribuir_grupos(chaves, n)
+
+
+# função auxiliar da executar_em_paralelo (roda no processo filho)
+# a partição chega como DataFrame (spawn) ou como posições da entrada compartilhada (fork)
+def _executar_particao(funcao, parte, parametros):
+    if not isinstance(parte, pd.DataFrame):
+        parte = _entrada_compartilhada.iloc[parte]
+    return funcao(df=parte.reset_index(drop=True), **parametros)
+
+
+# função auxiliar da executar_em_paralelo (roda no processo filho)
+# devolve também as métricas da partição, somadas depois às do processo principal
+def _executar_particao_processo(funcao, parte, parametros):
+    metricas.reiniciar()
+    return _executar_particao(funcao, parte, parametros), metricas.resumo()
+
+
+# função auxiliar da executar_em_paralelo
+# junta os resultados das partições na ordem da entrada e remove a coluna auxiliar
+# indice_original devolve os rótulos da entrada às funções que os mantêm (None para as que reiniciam o índice)
+def _juntar_resultados(resultados, indice_original):
+    # coordenada_numero_porta devolve uma lista de linhas (Series)
+    if resultados and isinstance(resultados[0], list):
+        linhas = sorted((linha for resultado in resultados for linha in resultado), key=lambda linha: linha[COLUNA_ORDEM])
+        juntas = []
+        for linha in linhas:
+            nome = indice_original[int(linha[COLUNA_ORDEM])]
+            linha = linha.drop(COLUNA_ORDEM)
+            linha.name = nome
+            juntas.append(linha)
+        return juntas
+
+    # as partições entram pela posição da primeira linha, reproduzindo a ordem das colunas do caminho serial
+    partes = sorted((resultado for resultado in resultados if len(resultado)), key=lambda resultado: resultado[COLUNA_ORDEM].iloc[0])
+    if not partes:
+        return resultados[0].drop(columns=COLUNA_ORDEM, errors='ignore')
+
+    juntos = pd.concat(partes, ignore_index=True)
+    juntos = juntos.sort_values(COLUNA_ORDEM, kind='stable')
+    ordem = juntos[COLUNA_ORDEM].to_numpy()
+    juntos = juntos.drop(columns=COLUNA_ORDEM)
+    if indice_original is None:
+        return juntos.reset_index(drop=True)
+    juntos.index = indice_original[ordem]
+    return juntos
+
+
+# Executa uma função de correção em partições da entrada num pool de processos
+# funcao recebe a partição em df= e os demais parâmetros por nome; particoes é a lista de posições de cada partição
+# manter_indice indica se a função devolve as linhas com os rótulos da entrada (como coordenada_numero_porta_lote)
+# camadas, índice de logradouros e polígonos por logradouro são montados uma vez antes do pool (carregar_indice_logradouros,
+# carregar_poligonos_por_logradouro); com fork os filhos os herdam prontos, com spawn cada processo monta uma vez
+def executar_em_paralelo(funcao, df, particoes, workers=None, manter_indice=False, **parametros):
+    global _entrada_compartilhada
+    workers = workers or workers_padrao()
+    entrada = df.reset_index(drop=True)
+    entrada[COLUNA_ORDEM] = np.arange(len(entrada))
+    indice_original = df.index if manter_indice else None
+
+    # aquece camadas, índice de logradouros e polígonos por logradouro no processo principal (guardados por versão das camadas)
+    vazio = funcao(df=entrada.iloc[:0], **parametros)
+    if not particoes:
+        return _juntar_resultados([vazio], indice_original)
+
+    if workers == 1 or len(particoes) <= 1:
+        resultados = [_executar_particao(funcao, entrada.iloc[posicoes], parametros) for posicoes in particoes]
+        return _juntar_resultados(resultados, indice_original)
+
+    metodos = multiprocessing.get_all_start_methods()
+    contexto = multiprocessing.get_context('fork' if 'fork' in metodos else 'spawn')
+    compartilhar = contexto.get_start_method() == 'fork'
+    _entrada_compartilhada = entrada
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as pool:
+            tarefas = [
+                pool.submit(_executar_particao_processo, funcao, posicoes if compartilhar else entrada.iloc[posicoes], parametros)
+                for posicoes in particoes]
+            resultados = []
+            for tarefa in tarefas:
+                resultado, resumo = tarefa.result()
+                metricas.incorporar(resumo)
+                resultados.append(resultado)
+    finally:
+        _entrada_compartilhada = None
+    return _juntar_resultados(resultados, indice_original)
+
+
+# função auxiliar das versões paralelas
+# partições por codlog ou por quadrado ('codlog' ou 'tile')
+def _particoes(df, particao, nome_coluna_log, coord_x, coord_y, workers):
+    n = (workers or workers_padrao()) * PARTICOES_POR_WORKER
+    if particao == 'tile':
+        return particoes_por_tile(df, nome_coluna_log, coord_x, coord_y, n)
+    return particoes_por_codlog(df, nome_coluna_log, n)
+
+
+# setor_fiscal_correto em paralelo (mesmo resultado do caminho serial)
+def setor_fiscal_correto_paralelo(caminho_arquivo_log, caminho_arquivo_setor, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, df, comprimento_minimo=0.0, workers=None, particao='codlog',
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_em_paralelo(
+        setor_fiscal_correto, df, _particoes(df, particao, nome_coluna_log, coord_x, coord_y, workers), workers,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_setor=caminho_arquivo_setor,
+        nome_coluna_log=nome_coluna_log, nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_sfiscal=nome_coluna_sfiscal, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
+
+
+# bairro_correcao em paralelo (mesmo resultado do caminho serial)
+def bairro_correcao_paralelo(caminho_arquivo_log, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_bairro, df, comprimento_minimo=0.0, workers=None, particao='codlog',
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_em_paralelo(
+        bairro_correcao, df, _particoes(df, particao, nome_coluna_log, coord_x, coord_y, workers), workers,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_bairro=caminho_arquivo_bairro,
+        nome_coluna_log=nome_coluna_log, nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_bairro=nome_coluna_bairro, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
+
+
+# setor_bairro_correcao em paralelo (mesmo resultado do caminho serial)
+def setor_bairro_correcao_paralelo(caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, nome_coluna_log, nome_coluna_nporta, coord_x, coord_y, nome_coluna_sfiscal, nome_coluna_bairro, df, coluna_codlog_eixos='codlog', encoding_eixos=None, comprimento_minimo=0.0, workers=None, particao='codlog',
+        extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False):
+    return executar_em_paralelo(
+        setor_bairro_correcao, df, _particoes(df, particao, nome_coluna_log, coord_x, coord_y, workers), workers,
+        caminho_arquivo_log=caminho_arquivo_log, caminho_arquivo_setor=caminho_arquivo_setor,
+        caminho_arquivo_bairro=caminho_arquivo_bairro, nome_coluna_log=nome_coluna_log,
+        nome_coluna_nporta=nome_coluna_nporta, coord_x=coord_x, coord_y=coord_y,
+        nome_coluna_sfiscal=nome_coluna_sfiscal, nome_coluna_bairro=nome_coluna_bairro,
+        coluna_codlog_eixos=coluna_codlog_eixos, encoding_eixos=encoding_eixos, comprimento_minimo=comprimento_minimo,
+        extensao=extensao, corrigir_coordenadas=corrigir_coordenadas)
+
+
+# coordenada_numero_porta em paralelo, particionada por logradouro (mesmo resultado do caminho serial)
+def coordenada_numero_porta_paralelo(caminho_pc, df, workers=None):
+    particoes = particoes_por_codlog(df, 'cod._logradouro_localização', (workers or workers_padrao()) * PARTICOES_POR_WORKER)
+    return executar_em_paralelo(coordenada_numero_porta, df, particoes, workers, manter_indice=True, caminho_pc=caminho_pc)
+
+
+# coordenada_numero_porta_lote em paralelo, particionada por logradouro (mesmo resultado do caminho serial)
+def coordenada_numero_porta_lote_paralelo(caminho_pc, df, workers=None):
+    particoes = particoes_por_codlog(df, 'cod._logradouro_localização', (workers or workers_padrao()) * PARTICOES_POR_WORKER)
+    return executar_em_paralelo(coordenada_numero_porta_lote, df, particoes, workers, manter_indice=True, caminho_pc=caminho_pc)
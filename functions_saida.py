@@ -0,0 +1,142 @@
+import glob
+import os
+
+import pandas as pd
+
+from functions_importacao import modulo_tardio
+
+
+gpd = modulo_tardio('geopandas')
+shapely = modulo_tardio('shapely')
+
+
+# linhas guardadas na memória antes de cada gravação no destino
+TAMANHO_LOTE_SAIDA = 50000
+
+
+# Coletor de resultados das funções de correção, coluna a coluna
+# cada linha sinalizada entra como valores nas listas das colunas (sem criar um DataFrame por linha)
+# sem destino os resultados ficam na memória e saem juntos em resultado()
+# com destino .csv as linhas são acrescentadas ao arquivo a cada tamanho_lote; com outro destino (diretório ou .parquet)
+# cada lote vira um arquivo parte_NNNNN.parquet (GeoParquet quando há coluna geometry)
+class ColetorResultados:
+    def __init__(self, destino=None, tamanho_lote=TAMANHO_LOTE_SAIDA, crs='EPSG:31984'):
+        self.destino = destino
+        self.tamanho_lote = tamanho_lote
+        self.crs = crs
+        self.colunas = {}
+        self.linhas_lote = 0
+        self.total = 0
+        self.partes = 0
+        self.colunas_arquivo = None
+        self.lotes_memoria = []
+        if destino and not self._csv():
+            os.makedirs(self.destino, exist_ok=True)
+            for antiga in glob.glob(os.path.join(self.destino, 'parte_*.parquet')):
+                os.remove(antiga)
+        elif destino and os.path.exists(destino):
+            os.remove(destino)
+
+    def __len__(self):
+        return self.total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.descarregar()
+
+    def _csv(self):
+        return str(self.destino).lower().endswith('.csv')
+
+    # Colunas que a saída pode ter, na ordem (as que aparecerem depois entram no fim)
+    # nos arquivos todas as partes ficam com essas colunas, mesmo que algum lote não tenha valores nelas
+    def prever_colunas(self, colunas):
+        for coluna in colunas:
+            if coluna not in self.colunas:
+                self.colunas[coluna] = [None] * self.linhas_lote
+
+    # Acrescenta uma linha (Series ou dict) com as colunas extras informadas por nome
+    def adicionar(self, linha, **extras):
+        valores = dict(linha.items()) if hasattr(linha, 'items') else dict(linha)
+        valores.update(extras)
+        for coluna, valor in valores.items():
+            if coluna not in self.colunas:
+                self.colunas[coluna] = [None] * self.linhas_lote
+            self.colunas[coluna].append(valor)
+        self.linhas_lote += 1
+        self.total += 1
+        # colunas que esta linha não tem ficam vazias
+        for lista in self.colunas.values():
+            if len(lista) < self.linhas_lote:
+                lista.append(None)
+        if self.linhas_lote >= self.tamanho_lote:
+            self.descarregar()
+
+    # Acrescenta um DataFrame inteiro (saída das funções vetorizadas)
+    def adicionar_df(self, df):
+        if df.empty:
+            return
+        self.descarregar()
+        self.prever_colunas(df.columns)
+        self.total += len(df)
+        self._gravar(df.reindex(columns=list(self.colunas)))
+
+    # Grava (ou guarda na memória) as linhas acumuladas
+    def descarregar(self):
+        if not self.linhas_lote:
+            return
+        lote = pd.DataFrame(self.colunas)
+        self.colunas = {coluna: [] for coluna in self.colunas}
+        self.linhas_lote = 0
+        self._gravar(lote)
+
+    # função auxiliar da descarregar
+    def _gravar(self, lote):
+        if not self.destino:
+            self.lotes_memoria.append(lote)
+            return
+
+        if self._csv():
+            if self.colunas_arquivo is None:
+                self.colunas_arquivo = list(lote.columns)
+            novas = [coluna for coluna in lote.columns if coluna not in self.colunas_arquivo]
+            if novas:
+                raise ValueError(f"Colunas {novas} surgiram depois do cabeçalho do CSV; informe-as antes em prever_colunas.")
+            lote.reindex(columns=self.colunas_arquivo).to_csv(
+                self.destino, mode='a', header=self.partes == 0, index=False)
+        else:
+            caminho = os.path.join(self.destino, f"parte_{self.partes:05d}.parquet")
+            if 'geometry' in lote.columns and lote['geometry'].map(lambda valor: isinstance(valor, shapely.Geometry) or valor is None).all():
+                gpd.GeoDataFrame(lote, geometry='geometry', crs=self.crs).to_parquet(caminho, index=False)
+            else:
+                lote.to_parquet(caminho, index=False)
+        self.partes += 1
+
+    # Resultados guardados na memória num único DataFrame (vazio se nenhuma linha foi coletada)
+    # com coluna geometry o resultado é um GeoDataFrame (linhas sem ponto ficam com geometria vazia)
+    def resultado(self):
+        self.descarregar()
+        if not self.lotes_memoria:
+            return pd.DataFrame()
+        if len(self.lotes_memoria) > 1:
+            self.lotes_memoria = [pd.concat(self.lotes_memoria, ignore_index=True)]
+        resultado = self.lotes_memoria[0]
+        if 'geometry' in resultado.columns and not isinstance(resultado, gpd.GeoDataFrame):
+            resultado = gpd.GeoDataFrame(resultado, geometry='geometry', crs=self.crs)
+            self.lotes_memoria = [resultado]
+        return resultado
+
+
+# Lê os resultados gravados por um ColetorResultados (arquivo .csv ou diretório de partes .parquet)
+def ler_resultados(destino):
+    if str(destino).lower().endswith('.csv'):
+        return pd.read_csv(destino) if os.path.exists(destino) else pd.DataFrame()
+    partes = []
+    for caminho in sorted(glob.glob(os.path.join(destino, 'parte_*.parquet'))):
+        try:
+            partes.append(gpd.read_parquet(caminho))
+        except ValueError:
+            # parte sem metadados de geometria
+            partes.append(pd.read_parquet(caminho))
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
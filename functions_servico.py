@@ -0,0 +1,295 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from functions_cache import carregar_camada, versao_camada
+from functions_coordenadas import EXTENSAO_SALVADOR, normalizar_coordenadas
+from functions_importacao import modulo_tardio
+from functions_log import configurar_log, contar, etapa, obter_logger
+from functions_logradouros import (carregar_tabela_sobreposicao, construir_indice_logradouros, poligonos_por_logradouro,
+                                   ponto_numero_porta)
+
+
+logger = obter_logger('servico')
+shapely = modulo_tardio('shapely')
+
+# segundos entre duas verificações de mudança das camadas em disco (feitas durante as consultas)
+INTERVALO_RECARGA = 2.0
+# endereço padrão do servidor http local
+HOST_SERVICO = '127.0.0.1'
+PORTA_SERVICO = 8765
+
+
+# função auxiliar da ServicoConsulta
+# polígonos de uma camada com índice espacial (STRtree) e os nomes na ordem das geometrias
+def _indexar_poligonos(camada, nome_coluna):
+    geometrias = camada.geometry.values
+    return {'arvore': shapely.STRtree(geometrias), 'nomes': camada[nome_coluna].to_numpy()}
+
+
+# função auxiliar da ServicoConsulta
+# primeiro polígono (na ordem da camada) que contém o ponto, como no sjoin das validações; None se nenhum
+def _poligono_do_ponto(poligonos, ponto, predicado):
+    encontrados = poligonos['arvore'].query(ponto, predicate=predicado)
+    if not len(encontrados):
+        return None
+    return poligonos['nomes'][encontrados.min()]
+
+
+# função auxiliar do servidor http
+# valores numpy (np.int64, np.str_, ...) em tipos json
+def _valor_json(valor):
+    return valor.item() if isinstance(valor, np.generic) else str(valor)
+
+
+# Serviço de consulta em memória para validar um endereço por vez (atendimento)
+# carrega uma vez eixos, setores fiscais e bairros, com índice de logradouros, STRtree dos polígonos e tabelas de sobreposição
+# responde por codlog + nº de porta (consultar_endereco) ou por coordenada (consultar_coordenada) em milissegundos
+# as camadas são recarregadas quando algum arquivo muda em disco (verificado no máximo a cada intervalo_recarga segundos);
+# durante a recarga as outras consultas continuam usando a versão anterior
+class ServicoConsulta:
+    def __init__(self, caminho_arquivo_log, caminho_arquivo_setor, caminho_arquivo_bairro, coluna_codlog_eixos='codlog',
+                 encoding_eixos=None, comprimento_minimo=0.0, extensao=EXTENSAO_SALVADOR, corrigir_coordenadas=False,
+                 intervalo_recarga=INTERVALO_RECARGA):
+        self.caminhos = {'log': caminho_arquivo_log, 'setor': caminho_arquivo_setor, 'bairro': caminho_arquivo_bairro}
+        self.coluna_codlog_eixos = coluna_codlog_eixos
+        self.encoding_eixos = encoding_eixos
+        self.comprimento_minimo = comprimento_minimo
+        self.extensao = extensao
+        self.corrigir_coordenadas = corrigir_coordenadas
+        self.intervalo_recarga = intervalo_recarga
+        self._trava_recarga = threading.Lock()
+        self._ultima_verificacao = time.monotonic()
+        self.consultas = 0
+        self.recargas = 0
+        self._camadas = self._carregar()
+
+    # função auxiliar da ServicoConsulta: lê as camadas e monta os índices (um dict novo, trocado de uma vez)
+    def _carregar(self):
+        inicio = time.perf_counter()
+        versoes = {nome: versao_camada(caminho) for nome, caminho in self.caminhos.items()}
+        with etapa('carregar_camadas'):
+            eixos = carregar_camada(self.caminhos['log'], encoding=self.encoding_eixos)
+            setores = carregar_camada(self.caminhos['setor'])
+            bairros = carregar_camada(self.caminhos['bairro'])
+        with etapa('indice_logradouros'):
+            indice = construir_indice_logradouros(eixos, self.coluna_codlog_eixos)
+            setores_indexados = _indexar_poligonos(setores, 'Name')
+            bairros_indexados = _indexar_poligonos(bairros, 'Bairro')
+        with etapa('sobreposicao'):
+            setores_por_logradouro = poligonos_por_logradouro(carregar_tabela_sobreposicao(
+                self.caminhos['log'], self.coluna_codlog_eixos, self.caminhos['setor'], 'Name', self.encoding_eixos),
+                self.comprimento_minimo)
+            bairros_por_logradouro = poligonos_por_logradouro(carregar_tabela_sobreposicao(
+                self.caminhos['log'], self.coluna_codlog_eixos, self.caminhos['bairro'], 'Bairro', self.encoding_eixos),
+                self.comprimento_minimo)
+        logger.info("Camadas do serviço de consulta carregadas em %.2f s (%d logradouros, %d setores, %d bairros).",
+                    time.perf_counter() - inicio, len(indice), len(setores), len(bairros),
+                    extra={'versoes': versoes})
+        return {
+            'versoes': versoes,
+            'carregado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'indice': indice,
+            'setores': setores_indexados,
+            'bairros': bairros_indexados,
+            'setores_por_logradouro': setores_por_logradouro,
+            'bairros_por_logradouro': bairros_por_logradouro,
+        }
+
+    # Recarrega as camadas se algum arquivo mudou em disco (ou sempre, com forcar); retorna True se recarregou
+    # só uma thread recarrega por vez; as demais seguem com as camadas atuais
+    def recarregar(self, forcar=False):
+        if not self._trava_recarga.acquire(blocking=False):
+            return False
+        try:
+            self._ultima_verificacao = time.monotonic()
+            versoes = {nome: versao_camada(caminho) for nome, caminho in self.caminhos.items()}
+            if not forcar and versoes == self._camadas['versoes']:
+                return False
+            alteradas = [nome for nome in versoes if versoes[nome] != self._camadas['versoes'].get(nome)]
+            logger.info("Recarregando camadas do serviço de consulta (alteradas: %s).", alteradas or 'nenhuma')
+            self._camadas = self._carregar()
+            self.recargas += 1
+            contar('servico_recarga')
+            return True
+        finally:
+            self._trava_recarga.release()
+
+    # função auxiliar das consultas: verifica mudanças em disco no máximo a cada intervalo_recarga segundos
+    def _camadas_atuais(self):
+        if self.intervalo_recarga is not None and time.monotonic() - self._ultima_verificacao >= self.intervalo_recarga:
+            try:
+                self.recarregar()
+            except Exception as e:
+                # camada sendo gravada ou inválida: continua com a versão carregada e tenta de novo depois
+                logger.warning("Falha ao recarregar camadas do serviço de consulta: %s", e)
+        self.consultas += 1
+        return self._camadas
+
+    # função auxiliar das consultas: setor fiscal e bairro do ponto
+    def _localizar_ponto(self, camadas, x, y):
+        ponto = shapely.Point(x, y)
+        return (_poligono_do_ponto(camadas['setores'], ponto, 'within'),
+                _poligono_do_ponto(camadas['bairros'], ponto, 'intersects'))
+
+    # Setor fiscal e bairro de um endereço (codlog + nº de porta), com as mesmas regras da setor_bairro_correcao
+    # com nº de porta: ponto interpolado no logradouro; sem nº de porta (0 ou vazio): setores/bairros cruzados pelo logradouro
+    # analise_manual indica logradouro sem nº de porta com mais de um setor fiscal ou bairro
+    # situacao: 'ok', 'logradouro_nao_encontrado' ou 'numero_invalido' (nº de porta preenchido mas não numérico, como '12A';
+    # nesse caso nada é localizado, em vez de tratar o endereço como sem nº de porta)
+    def consultar_endereco(self, codlog, numero):
+        inicio = time.perf_counter()
+        camadas = self._camadas_atuais()
+        resposta = {'codlog': codlog, 'numero': numero, 'situacao': 'ok', 'encontrado': codlog in camadas['indice'],
+                    'origem': None, 'x': None, 'y': None, 'alem_do_fim': False, 'setor_fiscal': None, 'bairro': None,
+                    'analise_manual': 'nao'}
+        with etapa('servico_consulta'):
+            sem_numero = numero is None or (isinstance(numero, str) and not numero.strip()) or (
+                not isinstance(numero, str) and pd.isna(numero))
+            numero = np.nan if sem_numero else pd.to_numeric(
+                numero.strip() if isinstance(numero, str) else numero, errors='coerce')
+            if not sem_numero and pd.isna(numero):
+                resposta['situacao'] = 'numero_invalido'
+                contar('numero_invalido')
+            elif resposta['encontrado']:
+                if sem_numero or numero == 0:
+                    setores = camadas['setores_por_logradouro'].get(codlog, ())
+                    bairros = camadas['bairros_por_logradouro'].get(codlog, ())
+                    resposta.update({
+                        'origem': 'interseção logradouro x setor fiscal/bairro',
+                        'setores_logradouro': list(setores),
+                        'bairros_logradouro': list(bairros),
+                        'setor_fiscal': setores[0] if len(setores) == 1 else None,
+                        'bairro': bairros[0] if len(bairros) == 1 else None,
+                        'analise_manual': 'sim' if len(setores) > 1 or len(bairros) > 1 else 'nao'})
+                else:
+                    # mesma escala de distância das validações (nº de porta / 100000)
+                    x, y, alem_do_fim = ponto_numero_porta(camadas['indice'], codlog, numero / 100000)
+                    resposta.update({'origem': 'localização pelo logradouro e nº de porta', 'x': round(x, 3),
+                                     'y': round(y, 3), 'alem_do_fim': alem_do_fim})
+                    if not alem_do_fim:
+                        resposta['setor_fiscal'], resposta['bairro'] = self._localizar_ponto(camadas, x, y)
+            else:
+                resposta['situacao'] = 'logradouro_nao_encontrado'
+                contar('logradouro_nao_encontrado')
+        resposta['milissegundos'] = round((time.perf_counter() - inicio) * 1000, 3)
+        logger.debug("Consulta de endereço: %s", resposta, extra={'codlog': codlog})
+        return resposta
+
+    # Setor fiscal e bairro de uma coordenada sedur (EPSG:31984, aceita vírgula decimal)
+    # a coordenada passa pela normalizar_coordenadas (situacao informa coordenada inválida, trocada, em graus, ...)
+    def consultar_coordenada(self, x, y):
+        inicio = time.perf_counter()
+        camadas = self._camadas_atuais()
+        with etapa('servico_consulta'):
+            coordenada = normalizar_coordenadas(
+                pd.DataFrame({'x': [x], 'y': [y]}), 'x', 'y', self.extensao, self.corrigir_coordenadas).iloc[0]
+            resposta = {'x': None, 'y': None, 'situacao': coordenada['situacao'], 'setor_fiscal': None, 'bairro': None}
+            if coordenada['valida']:
+                resposta['x'], resposta['y'] = float(coordenada['x']), float(coordenada['y'])
+                resposta['setor_fiscal'], resposta['bairro'] = self._localizar_ponto(
+                    camadas, coordenada['x'], coordenada['y'])
+        resposta['milissegundos'] = round((time.perf_counter() - inicio) * 1000, 3)
+        logger.debug("Consulta de coordenada: %s", resposta)
+        return resposta
+
+    # Estado do serviço: versões e momento da carga das camadas, consultas atendidas e recargas
+    def situacao(self):
+        camadas = self._camadas
+        return {'caminhos': self.caminhos, 'versoes': camadas['versoes'], 'carregado_em': camadas['carregado_em'],
+                'logradouros': len(camadas['indice']), 'consultas': self.consultas, 'recargas': self.recargas}
+
+
+# função auxiliar do servidor http
+# codlog da url como inteiro quando for número (os codlogs dos eixos são inteiros)
+def _codlog_da_url(valor):
+    try:
+        return int(valor)
+    except ValueError:
+        return valor
+
+
+# Requisições do servidor http local (GET, respostas em json)
+#   /endereco?codlog=...&numero=...   /coordenada?x=...&y=...   /situacao
+# nº de porta não numérico responde 400 (com a situacao 'numero_invalido')
+class ManipuladorConsulta(BaseHTTPRequestHandler):
+    servico = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parametros = {nome: valores[0] for nome, valores in parse_qs(url.query).items()}
+        try:
+            if url.path == '/endereco':
+                resposta = self.servico.consultar_endereco(
+                    _codlog_da_url(parametros['codlog']), parametros.get('numero', 0))
+                if resposta['situacao'] == 'numero_invalido':
+                    return self._responder(400, {'erro': f"nº de porta inválido: {parametros['numero']}", **resposta})
+            elif url.path == '/coordenada':
+                resposta = self.servico.consultar_coordenada(parametros['x'], parametros['y'])
+            elif url.path == '/situacao':
+                resposta = self.servico.situacao()
+            else:
+                return self._responder(404, {'erro': f"caminho desconhecido: {url.path}"})
+        except KeyError as e:
+            return self._responder(400, {'erro': f"parâmetro obrigatório ausente: {e.args[0]}"})
+        except Exception as e:
+            logger.exception("Erro na consulta %s", self.path)
+            return self._responder(500, {'erro': str(e)})
+        self._responder(200, resposta)
+
+    def _responder(self, status, dados):
+        corpo = json.dumps(dados, ensure_ascii=False, default=_valor_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    # acessos vão para o log do serviço (DEBUG) em vez da saída de erro
+    def log_message(self, formato, *args):
+        logger.debug("%s - %s", self.address_string(), formato % args)
+
+
+# Servidor http local para o serviço de consulta (uma thread por requisição)
+# com em_segundo_plano o servidor roda numa thread daemon e é devolvido (encerrar com servidor.shutdown())
+def iniciar_servidor(servico, host=HOST_SERVICO, porta=PORTA_SERVICO, em_segundo_plano=False):
+    manipulador = type('ManipuladorServico', (ManipuladorConsulta,), {'servico': servico})
+    servidor = ThreadingHTTPServer((host, porta), manipulador)
+    servidor.daemon_threads = True
+    logger.info("Serviço de consulta em http://%s:%d", host, servidor.server_address[1])
+    if em_segundo_plano:
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        return servidor
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Serviço de consulta encerrado.")
+    finally:
+        servidor.server_close()
+    return servidor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serviço local de consulta de setor fiscal e bairro por endereço ou coordenada.')
+    parser.add_argument('eixos')
+    parser.add_argument('setores')
+    parser.add_argument('bairros')
+    parser.add_argument('--coluna-codlog', default='codlog')
+    parser.add_argument('--encoding-eixos', default=None)
+    parser.add_argument('--comprimento-minimo', type=float, default=0.0)
+    parser.add_argument('--corrigir-coordenadas', action='store_true')
+    parser.add_argument('--host', default=HOST_SERVICO)
+    parser.add_argument('--porta', type=int, default=PORTA_SERVICO)
+    parser.add_argument('--log', default=None, help='nível do log (padrão: GEODADOS_LOG ou INFO)')
+    argumentos = parser.parse_args()
+    configurar_log(argumentos.log)
+    iniciar_servidor(ServicoConsulta(
+        argumentos.eixos, argumentos.setores, argumentos.bairros, argumentos.coluna_codlog, argumentos.encoding_eixos,
+        argumentos.comprimento_minimo, corrigir_coordenadas=argumentos.corrigir_coordenadas),
+        argumentos.host, argumentos.porta)
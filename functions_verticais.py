@@ -1,26 +1,117 @@
+import configparser
+import json
+import os
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.pool
 import pandas as pd
-from collections import Counter
+
+from functions_log import contar, etapa, obter_logger
+
+
+logger = obter_logger('verticais')
 
 
+# variáveis de ambiente com os parâmetros de conexão (têm prioridade sobre o arquivo de configuração)
+VARIAVEIS_BANCO = {
+    'host': 'GEODADOS_DB_HOST',
+    'port': 'GEODADOS_DB_PORT',
+    'dbname': 'GEODADOS_DB_NAME',
+    'user': 'GEODADOS_DB_USER',
+    'password': 'GEODADOS_DB_PASSWORD',
+}
+
+
+# Parâmetros de conexão com o banco
+# lidos do arquivo informado (ou de GEODADOS_DB_CONFIG): JSON ou INI com a seção [banco]
+# as variáveis GEODADOS_DB_* sobrescrevem o arquivo; o que faltar fica para o libpq (PGHOST, PGPASSWORD, ~/.pgpass, ...)
+def configuracao_banco(arquivo_config=None):
+    arquivo_config = arquivo_config or os.environ.get('GEODADOS_DB_CONFIG')
+    configuracao = {}
+    if arquivo_config:
+        if arquivo_config.lower().endswith('.json'):
+            with open(arquivo_config, encoding='utf-8') as arquivo:
+                configuracao = json.load(arquivo)
+        else:
+            leitor = configparser.ConfigParser()
+            leitor.read(arquivo_config, encoding='utf-8')
+            configuracao = dict(leitor['banco']) if leitor.has_section('banco') else {}
+        # 'database' é aceito como sinônimo de 'dbname'
+        if 'database' in configuracao:
+            configuracao.setdefault('dbname', configuracao.pop('database'))
+
+    for parametro, variavel in VARIAVEIS_BANCO.items():
+        if os.environ.get(variavel):
+            configuracao[parametro] = os.environ[variavel]
+    return configuracao
+
 
 # funcion conexão db
-def criar_conexao():
+# conexão avulsa com os parâmetros da configuracao_banco; para uso repetido prefira o pool (criar_pool)
+# falhas de conexão (psycopg2.OperationalError) são registradas no log e repassadas a quem chamou
+def criar_conexao(arquivo_config=None):
     try:
-        conn = psycopg2.connect(
-            host="xxxxxxxx",
-            database="xxxxxx",
-            user="xxxxx",
-            password="xxxxxx"
-        )
-        return conn
-    except Exception as e:
-        print(f"Erro ao conectar ao banco de dados: {e}")
-        return None
+        return psycopg2.connect(**configuracao_banco(arquivo_config))
+    except psycopg2.Error as e:
+        logger.error("Erro ao conectar ao banco de dados: %s", e)
+        contar('erros')
+        raise
+
+
+# Pool de conexões com o banco (thread-safe), com os parâmetros da configuracao_banco
+# as conexões são abertas uma vez e reaproveitadas entre as consultas; use com conexao_do_pool ou obter_conexao
+def criar_pool(minconn=1, maxconn=10, arquivo_config=None):
+    return psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **configuracao_banco(arquivo_config))
+
+
+# função auxiliar da conexao_do_pool
+# verifica se a conexão ainda responde (o servidor pode ter derrubado conexões ociosas)
+def _conexao_saudavel(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("select 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# Conexão emprestada do pool dentro de um bloco with
+# conexões quebradas são descartadas e trocadas por uma nova; ao sair do bloco faz commit
+# (ou rollback em caso de erro) e devolve a conexão ao pool
+@contextmanager
+def conexao_do_pool(pool, verificar=True):
+    conn = pool.getconn()
+    if verificar and not _conexao_saudavel(conn):
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+# Conexão para as funções de consulta: aceita um pool (empresta uma conexão) ou uma conexão já aberta (usada como está)
+@contextmanager
+def obter_conexao(conn_ou_pool):
+    if isinstance(conn_ou_pool, psycopg2.pool.AbstractConnectionPool):
+        with conexao_do_pool(conn_ou_pool) as conn:
+            yield conn
+    else:
+        yield conn_ou_pool
 
 
 
 # function para pegar intervalo de inscrições ativas do mesmo conjunto
+# conn pode ser uma conexão ou um pool de conexões (criar_pool)
 def intervalo_ativas_verticais(conn, cod_cliente, des_origem, cod_cadastro):
     try:
         tamanho_inscricao = len(cod_cadastro)
@@ -35,7 +126,7 @@ def intervalo_ativas_verticais(conn, cod_cliente, des_origem, cod_cadastro):
                 # base do intervalo para capturar todos os cadastros que começam com os primeiros dígitos
                 base_intervalo = f"{primeiros_digitos}%"
 
-                print("Base do Intervalo:", base_intervalo)
+                logger.debug("Base do Intervalo: %s", base_intervalo)
 
                 query = """
                     SELECT cod_cadastro, des_situacao_cadastro, num_imovel_1, num_hidrometro, cod_logradouro_1, num_sub_unidade, 
@@ -49,7 +140,7 @@ def intervalo_ativas_verticais(conn, cod_cliente, des_origem, cod_cadastro):
                     AND LENGTH(cod_cadastro) = %s;
                 """
 
-                with conn.cursor() as cur:
+                with obter_conexao(conn) as conexao, conexao.cursor() as cur:
                     # consulta usando a base do intervalo
                     cur.execute(query, (
                         cod_cliente,
@@ -59,7 +150,7 @@ def intervalo_ativas_verticais(conn, cod_cliente, des_origem, cod_cadastro):
                     ))
                     cadastros = cur.fetchall()
 
-                    print("Resultado da consulta:", cadastros)
+                    logger.debug("Resultado da consulta: %s", cadastros)
 
                     if cadastros:
                         # add resultados para um DataFrame
@@ -77,19 +168,147 @@ def intervalo_ativas_verticais(conn, cod_cliente, des_origem, cod_cadastro):
 
                         return df_intervalo, df_sem_sucesso
                     else:
-                        print("Nenhum dado encontrado.")
+                        logger.info("Nenhum dado encontrado para %s.", cod_cadastro)
                         return pd.DataFrame(), pd.DataFrame()  # df se não houver dados
         else:
-            print("Tamanho da inscrição inválido.")
+            logger.warning("Tamanho da inscrição %s inválido.", cod_cadastro)
+            contar('inscricao_invalida')
             return pd.DataFrame(), pd.DataFrame()
 
     except Exception as e:
-        print(f"Erro ao obter cadastros: {e}")
+        logger.exception("Erro ao obter cadastros: %s", e)
+        contar('erros')
         return pd.DataFrame(), pd.DataFrame()
 
 
 
 
+# colunas devolvidas pelas consultas de inscrições ativas verticais
+COLUNAS_VERTICAIS = [
+    'cod_cadastro', 'des_situacao_cadastro', 'num_imovel_1', 'num_hidrometro',
+    'cod_logradouro_1', 'num_sub_unidade', 'nom_edificio_1',
+    'nom_conjunto_habitacional_1', 'des_bloco_1', 'padrao_construtivo'
+]
+
+# índice parcial para as buscas por prefixo de inscrição (LIKE 'prefixo%' e faixas ~>=~/~<~)
+# text_pattern_ops permite a busca por prefixo em qualquer collation; o include permite index-only scan
+SQL_INDICE_VERTICAIS = """
+    create index concurrently if not exists cadastro_ativas_verticais_prefixo
+    on cadastro.cadastro (cod_cliente, des_origem, cod_cadastro text_pattern_ops)
+    include (des_situacao_cadastro, num_imovel_1, num_hidrometro, cod_logradouro_1, num_sub_unidade,
+             nom_edificio_1, nom_conjunto_habitacional_1, des_bloco_1, padrao_construtivo)
+    where utilizacao = 'RESIDENCIAL VERTICAL' and des_situacao_cadastro = 'ATIVO';
+"""
+
+
+# Cria o índice SQL_INDICE_VERTICAIS (uma vez por banco)
+# create index concurrently não roda dentro de transação: a conexão fica em autocommit durante a criação
+# a conexão não pode ter transação aberta (faça commit ou rollback antes); com um pool, uma conexão livre é usada
+def criar_indice_verticais(conn):
+    with obter_conexao(conn) as conexao:
+        if conexao.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raise psycopg2.ProgrammingError(
+                "criar_indice_verticais precisa de uma conexão sem transação aberta: faça commit ou rollback antes")
+        autocommit = conexao.autocommit
+        conexao.autocommit = True
+        try:
+            with conexao.cursor() as cur:
+                cur.execute(SQL_INDICE_VERTICAIS)
+                cur.execute("analyze cadastro.cadastro")
+        finally:
+            conexao.autocommit = autocommit
+
+
+# Prefixo do conjunto de uma inscrição (todos os dígitos menos os dois últimos)
+# retorna None para inscrições com tamanho diferente de 5 ou 7 ou que não terminam em dígito antes dos dois últimos
+def prefixo_inscricao(cod_cadastro):
+    cod_cadastro = str(cod_cadastro)
+    if len(cod_cadastro) not in [5, 7] or not cod_cadastro[-3].isdigit():
+        return None
+    return cod_cadastro[:-2]
+
+
+# junção de um array de prefixos (com os limites da limites_prefixos) com as inscrições ativas verticais de cada prefixo
+# parâmetros: prefixos, limites, cod_cliente, des_origem
+# a faixa [prefixo, limite) equivale ao LIKE 'prefixo%' e vira uma busca no índice por prefixo
+# o tamanho é comparado como diferença: uma igualdade length = length faria o planejador juntar tudo pelo tamanho
+JUNCAO_PREFIXOS = """
+        from unnest(%s::text[], %s::text[]) as p(prefixo, limite)
+        join cadastro.cadastro c
+          on c.cod_cliente = %s
+         and c.des_origem = %s
+         and c.cod_cadastro ~>=~ p.prefixo
+         and c.cod_cadastro ~<~ p.limite
+         and length(c.cod_cadastro) - length(p.prefixo) = 2
+        where c.utilizacao = 'RESIDENCIAL VERTICAL'
+          and c.des_situacao_cadastro = 'ATIVO'
+"""
+
+
+# limite superior da faixa de cada prefixo (último caractere + 1)
+def limites_prefixos(prefixos):
+    return [prefixo[:-1] + chr(ord(prefixo[-1]) + 1) for prefixo in prefixos]
+
+
+# Intervalo de inscrições ativas verticais de várias inscrições numa única consulta
+# os prefixos repetidos são consultados uma vez só, todos juntos (unnest de um array de prefixos)
+# retorna dict prefixo -> DataFrame com as inscrições do conjunto (vazio quando não há nenhuma); inscrições inválidas ficam de fora
+def intervalo_ativas_verticais_lote(conn, cod_cliente, des_origem, inscricoes):
+    todos_prefixos = [prefixo_inscricao(inscricao) for inscricao in inscricoes]
+    if None in todos_prefixos:
+        logger.warning("%d inscrições com tamanho inválido.", todos_prefixos.count(None))
+        contar('inscricao_invalida', todos_prefixos.count(None))
+    prefixos = list(dict.fromkeys(prefixo for prefixo in todos_prefixos if prefixo is not None))
+    if not prefixos:
+        return {}
+
+    query = f"""
+        select p.prefixo, {', '.join('c.' + coluna for coluna in COLUNAS_VERTICAIS)}
+        {JUNCAO_PREFIXOS}
+        order by p.prefixo, c.cod_cadastro
+    """
+    try:
+        with obter_conexao(conn) as conexao, conexao.cursor() as cur:
+            with etapa('leitura_banco'):
+                cur.execute(query, (prefixos, limites_prefixos(prefixos), cod_cliente, des_origem))
+                cadastros = cur.fetchall()
+    except Exception as e:
+        logger.exception("Erro ao obter cadastros: %s", e)
+        contar('erros')
+        return {}
+
+    # as linhas vêm ordenadas por prefixo: cada conjunto é uma fatia contínua do DataFrame
+    df_result = pd.DataFrame([cadastro[1:] for cadastro in cadastros], columns=COLUNAS_VERTICAIS)
+    inicios = [i for i in range(len(cadastros)) if i == 0 or cadastros[i][0] != cadastros[i - 1][0]]
+    grupos = {
+        cadastros[inicio][0]: df_result.iloc[inicio:fim].reset_index(drop=True)
+        for inicio, fim in zip(inicios, inicios[1:] + [len(cadastros)])}
+    return {prefixo: grupos[prefixo] if prefixo in grupos else pd.DataFrame(columns=COLUNAS_VERTICAIS)
+            for prefixo in prefixos}
+
+
+
+
+# participação mínima da moda no conjunto; abaixo disso o prédio é sinalizado como misto (padrões construtivos variados)
+LIMIAR_PREDIO_MISTO = 0.8
+
+
+# Moda do padrão construtivo por conjunto (5 primeiros dígitos do cod_cadastro) numa única passada agrupada
+# empates ficam com o padrão de menor valor (ordem crescente, vazios por último)
+# retorna DataFrame indexado pelo prefixo com moda, qtd_moda, total e moda_percentual
+def modas_por_conjunto(df_intervalo):
+    contagem = (df_intervalo.assign(prefixo=df_intervalo['cod_cadastro'].str[:5])
+                .groupby(['prefixo', 'padrao_construtivo'], dropna=False).size()
+                .rename('qtd_moda').reset_index())
+    contagem['total'] = contagem.groupby('prefixo')['qtd_moda'].transform('sum')
+    modas = (contagem.sort_values(['prefixo', 'qtd_moda', 'padrao_construtivo'], ascending=[True, False, True])
+             .drop_duplicates('prefixo')
+             .rename(columns={'padrao_construtivo': 'moda'})
+             .set_index('prefixo'))
+    modas['moda_percentual'] = modas['qtd_moda'] / modas['total']
+    return modas
+
+
 # function para definir moda do padrão construtivo
 def moda_padrao_construtivo(df_intervalo, inscricao):
     # primeiros 5 dígitos da inscrição fornecida (ou menos)
@@ -99,11 +318,9 @@ def moda_padrao_construtivo(df_intervalo, inscricao):
     df_filtrado = df_intervalo[df_intervalo['cod_cadastro'].str[:5]
                                == primeiros_digitos]
 
-    # moda de 'padrao_construtivo' para os registros filtrados
+    # moda de 'padrao_construtivo' para os registros filtrados (mesmo desempate da modas_por_conjunto)
     if not df_filtrado.empty:
-        frequencia = Counter(df_filtrado['padrao_construtivo'])
-        moda = frequencia.most_common(1)[0][0]  # pega o valor mais comum
-        return moda
+        return modas_por_conjunto(df_filtrado)['moda'].iloc[0]
     else:
         return None  # retorna nane se não tiver nenhuma correspondência
 
@@ -111,15 +328,57 @@ def moda_padrao_construtivo(df_intervalo, inscricao):
 
 
 # function para armazenar moda do padrão construtivo das inscrições do conjunto
-def criar_df_com_moda(df_intervalo, inscricoes):
-    # armazenar os resultados
-    resultados = []
+# as modas são calculadas uma vez por conjunto (modas_por_conjunto) e ligadas às inscrições pelo prefixo
+# moda_percentual é a participação da moda no conjunto; predio_misto sinaliza participação abaixo de limiar_misto
+def criar_df_com_moda(df_intervalo, inscricoes, limiar_misto=LIMIAR_PREDIO_MISTO):
+    if df_intervalo.empty:
+        modas = pd.DataFrame(columns=['moda', 'qtd_moda', 'total', 'moda_percentual'])
+    else:
+        modas = modas_por_conjunto(df_intervalo)
+    return _modas_das_inscricoes(inscricoes, modas, limiar_misto)
 
-    # calcula a moda para cada inscrição
-    for inscricao in inscricoes:  # itera sobre a lista de inscrições
-        moda = moda_padrao_construtivo(df_intervalo, inscricao)
-        resultados.append({'inscricao': inscricao, 'moda': moda})
 
-    # resultados em df
-    df_resultado = pd.DataFrame(resultados)
+# função auxiliar da criar_df_com_moda e da criar_df_com_moda_sql
+# liga as modas por conjunto (indexadas pelo prefixo de 5 dígitos) às inscrições
+def _modas_das_inscricoes(inscricoes, modas, limiar_misto):
+    df_resultado = pd.DataFrame({'inscricao': list(inscricoes)})
+    prefixos = df_resultado['inscricao'].astype(str).str[:5]
+    encontrado = prefixos.isin(modas.index)
+    df_resultado['moda'] = prefixos.map(modas['moda']).astype(object).where(encontrado, None)
+    df_resultado['moda_percentual'] = prefixos.map(modas['moda_percentual']).astype(float)
+    df_resultado['total'] = prefixos.map(modas['total']).fillna(0).astype(int)
+    df_resultado['predio_misto'] = df_resultado['moda_percentual'] < limiar_misto
     return df_resultado
+
+
+# Moda do padrão construtivo calculada no banco, junto da consulta de inscrições ativas verticais
+# mesma regra da criar_df_com_moda (conjunto pelos 5 primeiros dígitos, mesmo desempate), sem trazer as linhas do cadastro
+def criar_df_com_moda_sql(conn, cod_cliente, des_origem, inscricoes, limiar_misto=LIMIAR_PREDIO_MISTO):
+    prefixos = list(dict.fromkeys(
+        prefixo for prefixo in map(prefixo_inscricao, inscricoes) if prefixo is not None))
+    query = f"""
+        select prefixo, moda, moda_percentual, total
+        from (
+            select left(c.cod_cadastro, 5) as prefixo,
+                   c.padrao_construtivo as moda,
+                   count(*)::float / sum(count(*)) over w_conjunto as moda_percentual,
+                   sum(count(*)) over w_conjunto as total,
+                   row_number() over (partition by left(c.cod_cadastro, 5)
+                                      order by count(*) desc, c.padrao_construtivo asc nulls last) as posicao
+            {JUNCAO_PREFIXOS}
+            group by left(c.cod_cadastro, 5), c.padrao_construtivo
+            window w_conjunto as (partition by left(c.cod_cadastro, 5))
+        ) modas
+        where posicao = 1
+    """
+    try:
+        with obter_conexao(conn) as conexao, conexao.cursor() as cur:
+            with etapa('leitura_banco'):
+                cur.execute(query, (prefixos, limites_prefixos(prefixos), cod_cliente, des_origem))
+                modas = pd.DataFrame(cur.fetchall(), columns=['prefixo', 'moda', 'moda_percentual', 'total'])
+    except Exception as e:
+        logger.exception("Erro ao obter cadastros: %s", e)
+        contar('erros')
+        modas = pd.DataFrame(columns=['prefixo', 'moda', 'moda_percentual', 'total'])
+
+    return _modas_das_inscricoes(inscricoes, modas.set_index('prefixo'), limiar_misto)